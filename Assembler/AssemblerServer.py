@@ -0,0 +1,161 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import typing
+from Main import firstPass, secondPass, singlePass, assemble_path, TEXT_FORMAT, BINARY_FORMAT
+from HackBinary import BinaryHackWriter
+import Optimizer
+
+# A long running assembler, so that callers that assemble many programs pay for the
+# interpreter startup, the imports and the encoding tables (including the memo of
+# unusual C-command forms) only once.
+#
+# The protocol is JSON lines, one request and one response per line:
+#   request:  {"id": <any>, "source": "<asm text>"} or {"id": <any>, "path": "<.asm path>"}
+#             optional: "format": "text" | "binary", "single_pass": bool, "optimize": bool,
+#                       "write": bool - with "path", writes the output file next to the
+#                       .asm file exactly like the Assembler does and returns its path.
+#   response: {"id": <any>, "ok": true, "hack": "<.hack text>"}      (text format)
+#             with "optimize", the response also has "removed": <instructions removed>
+#             {"id": <any>, "ok": true, "bin": "<base64 words>"}     (binary format)
+#             {"id": <any>, "ok": true, "output_path": "<path>"}     ("write" requests)
+#             {"id": <any>, "ok": false, "error": "<description>"}
+
+
+def assemble_source(source: str, single_pass: bool = False, optimize: bool = False,
+                    output_format: str = TEXT_FORMAT) -> typing.Tuple[typing.Union[str, bytes], int]:
+    """
+    Args:
+        source (str): the text of an .asm program.
+        single_pass (bool): see Main.assemble_file.
+        optimize (bool): see Main.assemble_file.
+        output_format (str): TEXT_FORMAT or BINARY_FORMAT.
+
+    Returns:
+        str: the text of the assembled .hack program, or bytes: its packed words for
+        BINARY_FORMAT (assembled straight into a BinaryHackWriter, with no .hack text).
+        int: the number of instructions the optimizer removed.
+    """
+    input_file = io.StringIO(source)
+    removed = 0
+    if optimize:
+        input_file, removed = Optimizer.optimize(input_file)
+    if output_format == BINARY_FORMAT:
+        output_file = BinaryHackWriter(io.BytesIO())
+    else:
+        output_file = io.StringIO()
+    if single_pass:
+        singlePass(input_file, output_file)
+    else:
+        secondPass(input_file, output_file, firstPass(input_file))
+    if output_format == BINARY_FORMAT:
+        return output_file.tobytes(), removed
+    return output_file.getvalue(), removed
+
+
+def handle_request(request: dict) -> dict:
+    """
+    serves a single decoded request and returns the response to send back
+    """
+    response = {"id": request.get("id")}
+    try:
+        output_format = request.get("format", TEXT_FORMAT)
+        if output_format not in (TEXT_FORMAT, BINARY_FORMAT):
+            raise ValueError(f"unknown format '{output_format}'")
+        single_pass = bool(request.get("single_pass", False))
+        optimize = bool(request.get("optimize", False))
+
+        if "path" in request and request.get("write"):
+            response["output_path"], removed = assemble_path(os.path.abspath(request["path"]), output_format,
+                                                             single_pass, optimize=optimize)
+        else:
+            if "path" in request:
+                with open(request["path"], 'r') as input_file:
+                    source = input_file.read()
+            elif "source" in request:
+                source = request["source"]
+            else:
+                raise ValueError("a request needs either 'source' or 'path'")
+
+            output, removed = assemble_source(source, single_pass, optimize, output_format)
+            if output_format == BINARY_FORMAT:
+                response["bin"] = base64.b64encode(output).decode("ascii")
+            else:
+                response["hack"] = output
+        if optimize:
+            response["removed"] = removed
+        response["ok"] = True
+    except Exception as error:
+        response["ok"] = False
+        response["error"] = f"{type(error).__name__}: {error}"
+    return response
+
+
+def serve_lines(input_stream: typing.TextIO, output_stream: typing.TextIO) -> None:
+    """
+    answers JSON-line requests read from input_stream until it ends
+    """
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a JSON object")
+        except ValueError as error:
+            response = {"id": None, "ok": False, "error": f"bad request: {error}"}
+        else:
+            response = handle_request(request)
+        output_stream.write(json.dumps(response) + "\n")
+        output_stream.flush()
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    """serves the JSON-lines protocol over one socket connection"""
+
+    def handle(self) -> None:
+        input_stream = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        output_stream = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+        serve_lines(input_stream, output_stream)
+        output_stream.detach()
+        input_stream.detach()
+
+
+def serve_socket(socket_path: str) -> None:
+    """
+    listens on a local Unix socket, serving every connection on its own thread
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))   # so the socket file is removed
+    with socketserver.ThreadingUnixStreamServer(socket_path, _ConnectionHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if "__main__" == __name__:
+    # Without arguments, serves requests from stdin and writes the responses to stdout.
+    arg_parser = argparse.ArgumentParser(prog="AssemblerServer")
+    arg_parser.add_argument("--socket", metavar="PATH",
+                            help="serve on a local Unix socket instead of stdin/stdout")
+    args = arg_parser.parse_args()
+    if args.socket:
+        try:
+            serve_socket(args.socket)
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve_lines(sys.stdin, sys.stdout)
@@ -0,0 +1,107 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # bytes
+ENTRY_EXTENSION = ".out"
+
+
+class AssemblyCache:
+    """
+    An on-disk cache of assembler outputs, keyed by a hash of the .asm contents, the
+    assembler version and the output variant (format, optimizations...).
+    Every hit refreshes the entry's modification time, and when the cache grows over its
+    size cap the least recently used entries are evicted.
+    Entries are written atomically, so several processes may share one cache directory.
+    """
+
+    def __init__(self, cache_dir: str, version: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """
+        Args:
+            cache_dir (str): the cache directory, created if missing.
+            version (str): the assembler version, part of every key.
+            max_size (int): the maximal total size of the entries, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, source: bytes, variant: str) -> str:
+        """
+        Args:
+            source (bytes): the contents of the .asm file.
+            variant (str): describes the options that affect the output.
+
+        Returns:
+            str: the key of the assembled output.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{self.version}\0{variant}\0".encode())
+        digest.update(source)
+        return digest.hexdigest()
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """
+        copies the cached output of the given key to output_path
+        Returns:
+            bool: True on a cache hit, False otherwise
+        """
+        entry_path = self.__entry_path(key)
+        try:
+            shutil.copyfile(entry_path, output_path)
+            os.utime(entry_path)    # marks the entry as recently used
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """
+        adds the assembled file at output_path to the cache under the given key, and evicts
+        old entries if the cache got too big
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, self.__entry_path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        removes the least recently used entries until the cache fits in max_size
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(ENTRY_EXTENSION):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:   # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ENTRY_EXTENSION)
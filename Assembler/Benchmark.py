@@ -0,0 +1,203 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing
+from Main import firstPass, secondPass, singlePass, ASSEMBLER_VERSION
+from Parser import Parser
+from Code import Code
+import Optimizer
+
+# Measures the assembler throughput on the sample programs and on synthetic programs,
+# and saves the results as JSON so runs of different commits can be compared:
+#   python3 Benchmark.py --output before.json
+#   python3 Benchmark.py --output after.json --compare before.json
+
+SAMPLE_PROGRAMS = ["add/Add.asm", "max/Max.asm", "rect/Rect.asm", "pong/Pong.asm"]
+SYNTHETIC_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = "benchmark_results.json"
+SYNTHETIC_SEED = 2022
+
+SYNTHETIC_C_COMMANDS = ["D=M", "D=A", "M=D", "AM=M-1", "A=A-1", "M=M+1", "D=D+A", "M=D+M", "D=D-M",
+                        "M=-1", "M=0", "D;JGT", "D;JEQ", "D;JNE", "0;JMP", "M=M<<", "D=D>>"]
+
+
+def synthetic_program(line_count: int) -> str:
+    """
+    generates a deterministic assembly program of about line_count lines, mixing labels,
+    forward and backward jumps, variables, constants, C-commands, comments and blank lines.
+    every jump is right after loading a label, never a number (constants are data only), as
+    the optimizer leaves a program that jumps to numeric addresses as is
+    """
+    rand = random.Random(SYNTHETIC_SEED)
+    lines = []
+    label_count = 0
+    while len(lines) < line_count:
+        kind = rand.random()
+        if kind < 0.05:
+            lines.append(f"(LABEL{label_count})")
+            label_count += 1
+        elif kind < 0.10:
+            # jumps to an already defined or a still undefined label
+            lines.append(f"@LABEL{rand.randrange(label_count + 10)}")
+        elif kind < 0.20:
+            lines.append(f"@var{rand.randrange(200)}")
+        elif kind < 0.40:
+            lines.append(f"@{rand.randrange(32768)}")
+        elif kind < 0.45:
+            lines.append("// a comment line")
+        elif kind < 0.47:
+            lines.append("")
+        else:
+            command = rand.choice(SYNTHETIC_C_COMMANDS)
+            if Optimizer.JUMP_SEPARATOR in command:
+                lines.append(f"@LABEL{rand.randrange(label_count + 10)}")
+            lines.append("    " + command + "    // trailing comment")
+    # every referenced label must exist
+    for label in range(label_count, label_count + 10):
+        lines.append(f"(LABEL{label})")
+    return "\n".join(lines) + "\n"
+
+
+def stage_first_pass(source: str) -> typing.Callable[[], object]:
+    return lambda: firstPass(io.StringIO(source))
+
+
+def stage_second_pass(source: str) -> typing.Callable[[], object]:
+    table = firstPass(io.StringIO(source))
+    # secondPass adds the variables to the table, so every run gets a fresh copy
+    return lambda: secondPass(io.StringIO(source), io.StringIO(), copy.deepcopy(table))
+
+
+def stage_single_pass(source: str) -> typing.Callable[[], object]:
+    return lambda: singlePass(io.StringIO(source), io.StringIO())
+
+
+def stage_encoding(source: str) -> typing.Callable[[], object]:
+    """only the Code part: encoding every C-command and every numeric A-command"""
+    par = Parser(io.StringIO(source))
+    c_commands, numbers = [], []
+    while par.has_more_commands():
+        par.advance()
+        command = par.cur_command
+        if command[0] == "@":
+            if command[1:].isdigit():
+                numbers.append(int(command[1:]))
+        elif command[0] != "(":
+            c_commands.append(command)
+
+    def encode():
+        for command in c_commands:
+            Code.c_command(command)
+        for number in numbers:
+            Code.toBinary(number)
+    return encode
+
+
+def stage_optimizer(source: str) -> typing.Callable[[], object]:
+    return lambda: Optimizer.optimize(io.StringIO(source))
+
+
+STAGES = {"first_pass": stage_first_pass, "second_pass": stage_second_pass,
+          "single_pass": stage_single_pass, "encoding": stage_encoding, "optimizer": stage_optimizer}
+
+
+def measure(stage: typing.Callable[[], object], repeat: int) -> typing.Tuple[float, int]:
+    """
+    Returns:
+        float: the best wall time of the stage over `repeat` runs, in seconds.
+        int: the peak memory allocated while the stage ran, in bytes (measured in a
+        separate run, as tracing slows the code down).
+    """
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        stage()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(programs: typing.Dict[str, str], repeat: int) -> typing.List[dict]:
+    results = []
+    for name, source in programs.items():
+        line_count = source.count("\n")
+        for stage_name, make_stage in STAGES.items():
+            seconds, peak = measure(make_stage(source), repeat)
+            lines_per_second = line_count / seconds if seconds else None   # a tiny input may measure 0 seconds
+            results.append({"program": name, "stage": stage_name, "lines": line_count,
+                            "seconds": seconds, "lines_per_second": lines_per_second,
+                            "peak_memory_bytes": peak})
+            rate = "n/a" if lines_per_second is None else f"{lines_per_second:,.0f}"
+            print(f"{name:>16} {stage_name:>12}: {rate:>12} lines/s "
+                  f"{peak / 1024:10,.0f} KiB peak", file=sys.stderr)
+    return results
+
+
+def describe_environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "assembler_version": ASSEMBLER_VERSION, "python": platform.python_version(),
+            "platform": platform.platform(), "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def compare(results: typing.List[dict], baseline_path: str) -> None:
+    """
+    prints the throughput of every benchmark relative to a previously saved run
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {(result["program"], result["stage"]): result for result in json.load(baseline_file)["results"]}
+    for result in results:
+        old = baseline.get((result["program"], result["stage"]))
+        if old is None or not old["lines_per_second"] or not result["lines_per_second"]:
+            continue
+        ratio = result["lines_per_second"] / old["lines_per_second"]
+        print(f"{result['program']:>16} {result['stage']:>12}: x{ratio:.2f} throughput, "
+              f"x{result['peak_memory_bytes'] / max(old['peak_memory_bytes'], 1):.2f} peak memory")
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(prog="Benchmark")
+    arg_parser.add_argument("--sizes", default=",".join(str(size) for size in SYNTHETIC_SIZES),
+                            help="comma separated line counts of the synthetic programs")
+    arg_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per measurement")
+    arg_parser.add_argument("--output", default=DEFAULT_OUTPUT, help="where to save the JSON results")
+    arg_parser.add_argument("--compare", metavar="JSON", help="a previous results file to compare against")
+    args = arg_parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    programs = dict()
+    for sample in SAMPLE_PROGRAMS:
+        with open(os.path.join(base_dir, sample)) as sample_file:
+            programs[os.path.basename(sample)] = sample_file.read()
+    for size in filter(None, args.sizes.split(",")):
+        programs[f"synthetic-{int(size)}"] = synthetic_program(int(size))
+
+    results = run_benchmarks(programs, args.repeat)
+    with open(args.output, "w") as output_file:
+        json.dump({"environment": describe_environment(), "repeat": args.repeat, "results": results},
+                  output_file, indent=2)
+    if args.compare:
+        compare(results, args.compare)
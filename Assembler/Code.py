@@ -11,6 +11,13 @@ COMP_DICT = {"0":"101010", "1":"111111", "-1":"111010", "D":"001100", "A":"11000
              "!M":"110001", "-M":"110011", "M+1":"110111", "M-1":"110010", "D+M":"000010", "D-M":"010011",
              "M-D":"000111", "D&M":"000000", "D|M":"010101", "D<<":"110000", "A<<":"100000", "M<<":"100000",
              "D>>":"010000", "A>>":"000000", "M>>":"000000"}
+JUMP_DICT = {"": "000", "JGT": "001", "JEQ": "010", "JGE": "011", "JLT": "100", "JNE": "101", "JLE": "110",
+             "JMP": "111"}
+DEST_MNEMONICS = ["", "M", "D", "MD", "A", "AM", "AD", "AMD"]
+COMMUTATIVE_OPS = "+&|"
+SHIFT_OPS = ("<<", ">>")
+C_PREFIX = "111"
+SHIFT_PREFIX = "101"
 
 
 class Code:
@@ -63,15 +70,83 @@ class Code:
         Returns:
             str: 3-bit long binary code of the given mnemonic.
         """
-        return {"": "000", "JGT": "001", "JEQ": "010", "JGE": "011", "JLT": "100", "JNE": "101", "JLE": "110",
-                "JMP": "111"}[mnemonic]
+        return JUMP_DICT[mnemonic]
 
     @staticmethod
     def toBinary(number: int) -> str:
         """
         gets a number(int) in base 10 and translates it to binary base using 16 bits
         """
-        binary_raw = (str(bin(number)))[2:]
-        zeros_to_add = Code.BINARY_REP_LEN - len(binary_raw)
-        return "0" * zeros_to_add + str(binary_raw)
+        return format(number, "016b")
+
+    @staticmethod
+    def c_command(command: str) -> str:
+        """
+        Args:
+            command (str): a whole cleaned C-command, e.g. "AM=M-1" or "D;JGT".
+
+        Returns:
+            str: the 16-bit long binary code of the command, taken from the precomputed
+            table. Forms that are not in the table (e.g. "DM=M+D") are encoded once and
+            memoized.
+        """
+        binary_rep = C_COMMAND_TABLE.get(command)
+        if binary_rep is None:
+            binary_rep = _encode_c_command(command)
+            C_COMMAND_TABLE[command] = binary_rep
+        return binary_rep
+
+    @staticmethod
+    def c_command_word(command: str) -> int:
+        """
+        Args:
+            command (str): a whole cleaned C-command, e.g. "AM=M-1" or "D;JGT".
+
+        Returns:
+            int: the 16-bit word of the command, for the binary format. every distinct
+            command is converted from its binary code once and memoized.
+        """
+        word = C_WORD_TABLE.get(command)
+        if word is None:
+            word = C_WORD_TABLE[command] = int(Code.c_command(command), 2)
+        return word
+
+
+def _encode_c_command(command: str) -> str:
+    """
+    encodes a C-command that is not in the precomputed table. the dest letters may come in any
+    order, and the operands of commutative comps may be swapped (M+D is D+M)
+    """
+    dest, equals, comp = command.rpartition("=")
+    comp, semicolon, jump = comp.partition(";")
+    if comp not in COMP_DICT and len(comp) == 3 and comp[1] in COMMUTATIVE_OPS:
+        comp = comp[2] + comp[1] + comp[0]
+    if comp not in COMP_DICT:
+        raise KeyError(f"Invalid comp '{comp}' in C-command '{command}'")
+    if any(shift in comp for shift in SHIFT_OPS):
+        prefix = SHIFT_PREFIX
+    else:
+        prefix = C_PREFIX
+    return prefix + Code.comp(comp) + Code.dest(dest) + Code.jump(jump)
+
+
+def _build_c_command_table() -> dict:
+    """
+    precomputes the binary code of every dest=comp;jump combination
+    """
+    table = dict()
+    for comp in COMP_DICT:
+        for dest in DEST_MNEMONICS:
+            for jump in JUMP_DICT:
+                command = comp
+                if dest:
+                    command = dest + "=" + command
+                if jump:
+                    command = command + ";" + jump
+                table[command] = _encode_c_command(command)
+    return table
+
+
+C_COMMAND_TABLE = _build_c_command_table()
+C_WORD_TABLE = dict()
 
@@ -0,0 +1,107 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import array
+import mmap
+import sys
+import typing
+
+BINARY_EXTENSION = ".bin"
+WORD_TYPECODE = "H"     # unsigned 16 bit
+WORD_SIZE = 2
+
+
+class BinaryHackWriter:
+    """
+    Writes the assembler output as packed little-endian uint16 words (2 bytes per
+    instruction) instead of 16 ASCII digits and a newline per instruction.
+    It is passed to the assembling passes in place of the output file, and takes the
+    assembled words as integers, with no binary text made for them.
+    """
+
+    def __init__(self, output_file: typing.BinaryIO) -> None:
+        """
+        Args:
+            output_file (typing.BinaryIO): a file opened for binary writing.
+        """
+        self.output = output_file
+        self.words = array.array(WORD_TYPECODE)
+
+    def write_words(self, words: typing.Iterable[int]) -> None:
+        """
+        packs the given instruction words
+        """
+        self.words.extend(words)
+
+    def tobytes(self) -> bytes:
+        """
+        Returns:
+            bytes: the words packed so far, little-endian, as they are written to the file.
+        """
+        if sys.byteorder == "big":
+            words = array.array(WORD_TYPECODE, self.words)
+            words.byteswap()
+            return words.tobytes()
+        return self.words.tobytes()
+
+    def close(self) -> None:
+        """
+        writes all packed words to the output file and closes it
+        """
+        if sys.byteorder == "big":
+            self.words.byteswap()
+        self.words.tofile(self.output)
+        self.output.close()
+
+
+def load_rom(path: str) -> array.array:
+    """
+    loads a packed .bin ROM image into an array('H') of words, with no text parsing.
+    the file is memory mapped and copied into the array in one go
+    """
+    rom = array.array(WORD_TYPECODE)
+    with open(path, "rb") as rom_file:
+        mapped = _map_file(rom_file)
+    if mapped is not None:
+        with mapped:
+            rom.frombytes(mapped)
+    if sys.byteorder == "big":
+        rom.byteswap()
+    return rom
+
+
+def map_rom(path: str):
+    """
+    maps a packed .bin ROM image into memory without copying it.
+    returns a read-only NumPy uint16 view if NumPy is installed, otherwise a
+    memoryview of words over the mapped file (or an array('H') copy on big-endian hosts)
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        return numpy.memmap(path, dtype="<u2", mode="r")
+    if sys.byteorder == "big":
+        return load_rom(path)
+    with open(path, "rb") as rom_file:
+        mapped = _map_file(rom_file)
+    if mapped is None:
+        return memoryview(array.array(WORD_TYPECODE))
+    return memoryview(mapped).cast(WORD_TYPECODE)
+
+
+def _map_file(rom_file: typing.BinaryIO):
+    """
+    maps the whole file read-only. returns None for an empty file, which cannot be mapped
+    """
+    size = rom_file.seek(0, 2)
+    if size % WORD_SIZE:
+        raise ValueError(f"{rom_file.name} is not a packed ROM image (odd size {size})")
+    if size == 0:
+        return None
+    return mmap.mmap(rom_file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -4,33 +4,70 @@ https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
 and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0 
 Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
 import os
 import sys
 import typing
 from SymbolTable import SymbolTable
 from Parser import Parser
 from Code import Code
+from HackBinary import BinaryHackWriter, BINARY_EXTENSION
+from AssemblyCache import AssemblyCache, DEFAULT_MAX_SIZE
+import Optimizer
+import SizeMap
 
 A_COMMAND = "A_COMMAND"
 L_COMMAND = "L_COMMAND"
 C_COMMAND = "C_COMMAND"
 RAM_STARTING_SECOND_PASS = 16
+ASSEMBLER_VERSION = "1.3"   # part of the cache keys - bump whenever the generated code changes
+TEXT_FORMAT = "text"
+BINARY_FORMAT = "binary"
+SIZE_MAP_EXTENSION = ".map"
 
 
-def assemble_file(input_file: typing.TextIO, output_file: typing.TextIO) -> None:
+def assemble_file(input_file: typing.TextIO, output_file: typing.TextIO, single_pass: bool = False,
+                  optimize: bool = False, size_map_file: typing.Optional[typing.TextIO] = None,
+                  size_map_top: int = SizeMap.DEFAULT_TOP) -> int:
     """Assembles a single file.
 
     Args:
         input_file (typing.TextIO): the file to assemble.
         output_file (typing.TextIO): writes all output to this file.
+        single_pass (bool): if True, assembles the file in one streaming pass
+        with label backpatching instead of the classic two passes.
+        optimize (bool): if True, the program goes through the optimizer before
+        the addresses are assigned.
+        size_map_file (typing.TextIO): if given, the ROM size map of the assembled
+        program (after the optimizer) is written to this file.
+        size_map_top (int): the number of largest regions listed in the size map.
+
+    Returns:
+        int: the number of instructions the optimizer removed.
     """
     if not input_file or not output_file:
-        return
+        return 0
+
+    removed = 0
+    if optimize:
+        source_file = input_file
+        input_file, removed = Optimizer.optimize(source_file)
+        source_file.close()
+
+    if size_map_file is not None:
+        SizeMap.write_size_map(Optimizer.read_commands(input_file), size_map_file, size_map_top)
+        size_map_file.close()
+        input_file.seek(0)
 
-    sym_table = firstPass(input_file)
-    secondPass(input_file, output_file, sym_table)
+    if single_pass:
+        singlePass(input_file, output_file)
+    else:
+        sym_table = firstPass(input_file)
+        secondPass(input_file, output_file, sym_table)
     input_file.close()
     output_file.close()
+    return removed
 
 
 def firstPass(input_file: typing.TextIO) -> SymbolTable:
@@ -59,28 +96,164 @@ def secondPass(input_file: typing.TextIO, output_file: typing.TextIO, table: Sym
     par = Parser(input_file)
     ram_address = RAM_STARTING_SECOND_PASS
     translator = Code()
+    words = []
 
     while par.has_more_commands():
         par.advance()
-        if par.command_type() == A_COMMAND and not par.cur_command[1:].isdigit():
+        command_type = par.command_type()
+        if command_type == C_COMMAND:
+            words.append(translator.c_command_word(par.cur_command))
+        elif command_type == A_COMMAND:
+            symbol = par.cur_command[1:]
+            if symbol.isdigit():
+                words.append(int(symbol))
+            else:
+                if not table.contains(symbol):
+                    table.add_entry(symbol, ram_address)
+                    ram_address += 1
+                words.append(table.get_address(symbol))
+    write_words(output_file, words)
+
+
+def singlePass(input_file: typing.TextIO, output_file: typing.TextIO) -> None:
+    """
+    assembles the file in a single streaming pass. labels are added to the table as soon as they
+    are met, A-commands whose symbol is not known yet are emitted as placeholders and backpatched
+    once the whole file was read. symbols that never turned out to be labels are allocated as
+    variables by order of first use, so the output is identical to the two passes output
+    """
+    par = Parser(input_file, stream=True)
+    table = SymbolTable()
+    translator = Code()
+    instructions = []
+    forward_refs = dict()   # symbol -> indices of the instructions waiting for its address
+
+    while par.has_more_commands():
+        par.advance()
+        command_type = par.command_type()
+        if command_type == L_COMMAND:
+            table.add_entry(par.symbol(), len(instructions))
+        elif command_type == A_COMMAND:
             symbol = par.symbol()
-            if symbol not in table.table.keys():
-                table.add_entry(symbol, ram_address)
-                ram_address += 1
-            binary_rep = translator.toBinary(table.get_address(symbol))
-            # val_to_bin = table.get_address(symbol)
-        elif par.command_type() == A_COMMAND and par.cur_command[1:].isdigit():
-            binary_rep = translator.toBinary(int(par.cur_command[1:]))
-            # val_to_bin = int(par.cur_command[1:])
-        elif par.command_type() == C_COMMAND:
-            dest, comp, jump = par.dest(), par.comp(), par.jump()
-            if par.is_shift():
-                binary_rep = "101" + translator.comp(comp) + translator.dest(dest) + translator.jump(jump)
+            if symbol.isdigit():
+                instructions.append(int(symbol))
+            elif table.contains(symbol):
+                instructions.append(table.get_address(symbol))
             else:
-                binary_rep = "111" + translator.comp(comp) + translator.dest(dest) + translator.jump(jump)
+                forward_refs.setdefault(symbol, []).append(len(instructions))
+                instructions.append(None)
+        else:
+            instructions.append(translator.c_command_word(par.cur_command))
+
+    ram_address = RAM_STARTING_SECOND_PASS
+    for symbol, indices in forward_refs.items():
+        if not table.contains(symbol):
+            table.add_entry(symbol, ram_address)
+            ram_address += 1
+        address = table.get_address(symbol)
+        for index in indices:
+            instructions[index] = address
+
+    write_words(output_file, instructions)
+
+
+def write_words(output_file: typing.Union[typing.TextIO, BinaryHackWriter], words: typing.List[int]) -> None:
+    """
+    writes the assembled words: a BinaryHackWriter takes them as they are, a text file gets
+    every word as a line of 16 binary digits
+    """
+    if isinstance(output_file, BinaryHackWriter):
+        output_file.write_words(words)
+    else:
+        output_file.write("".join(Code.toBinary(word) + "\n" for word in words))
+
+
+def assemble_path(input_path: str, output_format: str = TEXT_FORMAT, single_pass: bool = False,
+                  cache: typing.Optional[AssemblyCache] = None,
+                  optimize: bool = False,
+                  size_map_top: typing.Optional[int] = None) -> typing.Tuple[str, typing.Optional[int]]:
+    """Opens an .asm file and its output file, and assembles it.
+    Everything needed is created per call (including the SymbolTable), so it
+    can run in a worker process independently of other files.
+
+    Args:
+        input_path (str): path of the .asm file.
+        output_format (str): TEXT_FORMAT for a .hack file, BINARY_FORMAT for a .bin file.
+        single_pass (bool): see assemble_file.
+        cache (AssemblyCache): if given, the output is taken from the cache when the same
+        source was already assembled, and stored in it otherwise.
+        optimize (bool): see assemble_file.
+        size_map_top (int): if given, the ROM size map is written to a .map file next to
+        the output, listing this number of largest regions. the cache is not read then,
+        as the map is made while assembling.
+
+    Returns:
+        str: the path of the output file.
+        int: the number of instructions the optimizer removed, None if the output was
+        taken from the cache.
+    """
+    filename, extension = os.path.splitext(input_path)
+    output_path = filename + (BINARY_EXTENSION if output_format == BINARY_FORMAT else ".hack")
+    if cache is not None:
+        with open(input_path, 'rb') as input_file:
+            cache_key = cache.key(input_file.read(), output_format + ("-optimized" if optimize else ""))
+        if size_map_top is None and cache.fetch(cache_key, output_path):
+            return output_path, None
+
+    size_map_file = None
+    if size_map_top is not None:
+        size_map_file = open(filename + SIZE_MAP_EXTENSION, 'w')
+    if output_format == BINARY_FORMAT:
+        with open(input_path, 'r') as input_file, \
+                open(output_path, 'wb') as output_file:
+            removed = assemble_file(input_file, BinaryHackWriter(output_file), single_pass, optimize,
+                                    size_map_file, size_map_top)
+    else:
+        with open(input_path, 'r') as input_file, \
+                open(output_path, 'w') as output_file:
+            removed = assemble_file(input_file, output_file, single_pass, optimize, size_map_file, size_map_top)
+
+    if cache is not None:
+        cache.store(cache_key, output_path)
+    return output_path, removed
+
+
+def describe_result(input_path: str, output_path: str, removed: typing.Optional[int], optimize: bool) -> str:
+    """
+    a report line for an assembled file
+    """
+    description = f"{input_path} -> {output_path}"
+    if removed is None:
+        description += " (cached)"
+    elif optimize:
+        description += f" (optimizer removed {removed} instructions)"
+    return description
+
+
+def assemble_in_parallel(input_paths: typing.List[str], jobs: int, output_format: str,
+                         single_pass: bool, cache: typing.Optional[AssemblyCache] = None,
+                         optimize: bool = False, size_map_top: typing.Optional[int] = None) -> bool:
+    """
+    assembles the files on a pool of `jobs` worker processes, then reports the result of
+    every file together, in the order of input_paths
+    Returns:
+        bool: True if all the files were assembled successfully
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(assemble_path, input_path, output_format, single_pass, cache, optimize,
+                               size_map_top)
+                   for input_path in input_paths]
+        concurrent.futures.wait(futures)
+
+    all_ok = True
+    for input_path, future in zip(input_paths, futures):
+        error = future.exception()
+        if error is None:
+            print(describe_result(input_path, *future.result(), optimize))
         else:
-            continue
-        output_file.write(binary_rep + "\n")
+            all_ok = False
+            print(f"{input_path}: FAILED ({type(error).__name__}: {error})", file=sys.stderr)
+    return all_ok
 
 
 if "__main__" == __name__:
@@ -89,20 +262,46 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: Assembler <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(prog="Assembler")
+    arg_parser.add_argument("input_path", help="an .asm file or a directory of .asm files")
+    arg_parser.add_argument("--single-pass", action="store_true",
+                            help="assemble in one streaming pass, backpatching forward label references")
+    arg_parser.add_argument("--format", choices=[TEXT_FORMAT, BINARY_FORMAT], default=TEXT_FORMAT,
+                            help="'text' writes a .hack file, 'binary' writes packed little-endian "
+                                 "uint16 words to a .bin file")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                            help="assemble the files of a directory on N worker processes")
+    arg_parser.add_argument("--cache", metavar="DIR",
+                            help="reuse the outputs of previously assembled identical sources from DIR")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), metavar="MB",
+                            help="evict the least recently used cache entries above this size")
+    arg_parser.add_argument("--optimize", "-O", action="store_true",
+                            help="run the peephole optimizer before assigning addresses. a program "
+                                 "that jumps to a numeric ROM address kept in memory (rather than "
+                                 "right after loading it) must not be optimized")
+    arg_parser.add_argument("--size-map", type=int, nargs="?", const=SizeMap.DEFAULT_TOP, metavar="TOP",
+                            help="write a .map file with the ROM address range of every label and the "
+                                 "size of every function, listing the TOP largest first")
+    args = arg_parser.parse_args()
+    argument_path = os.path.abspath(args.input_path)
     if os.path.isdir(argument_path):
         files_to_assemble = [
             os.path.join(argument_path, filename)
             for filename in os.listdir(argument_path)]
     else:
         files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-        if extension.lower() != ".asm":
-            continue
-        output_path = filename + ".hack"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            assemble_file(input_file, output_file)
+    cache = None
+    if args.cache:
+        cache = AssemblyCache(args.cache, ASSEMBLER_VERSION, args.cache_size * 1024 * 1024)
+    files_to_assemble = [input_path for input_path in files_to_assemble
+                         if os.path.splitext(input_path)[1].lower() == ".asm"]
+    if args.jobs > 1 and len(files_to_assemble) > 1:
+        if not assemble_in_parallel(files_to_assemble, args.jobs, args.format, args.single_pass, cache,
+                                    args.optimize, args.size_map):
+            sys.exit(1)
+    else:
+        for input_path in files_to_assemble:
+            output_path, removed = assemble_path(input_path, args.format, args.single_pass, cache, args.optimize,
+                                                 args.size_map)
+            if args.optimize:
+                print(describe_result(input_path, output_path, removed, args.optimize))
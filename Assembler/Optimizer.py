@@ -0,0 +1,273 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import io
+import typing
+from Parser import Parser
+
+A_PREFIX = "@"
+L_PREFIX = "("
+JUMP_SEPARATOR = ";"
+UNCONDITIONAL_JUMP = "JMP"
+
+# pushing D to the stack, in the two shapes the VM translator emits
+PUSH_D = [["@SP", "A=M", "M=D", "@SP", "M=M+1"],
+          ["@SP", "M=M+1", "A=M-1", "M=D"]]
+# popping the stack to D
+POP_D = ["@SP", "AM=M-1", "D=M"]
+# popping the stack to D and pointing A at the new top, before a binary operation
+POP_D_TO_BINARY_OP = ["@SP", "AM=M-1", "D=M", "A=A-1"]
+TOP_ADDRESS = ["@SP", "A=M-1"]
+
+MAX_ROUNDS = 10
+
+
+def optimize(input_file: typing.TextIO) -> typing.Tuple[typing.TextIO, int]:
+    """
+    runs the optimizer over the given assembly file, before any address is assigned:
+    first the control flow passes - jump threading and the removal of unreachable
+    blocks - then the peephole rewrites. the peephole rewrites only rely on the values
+    of A, D and the memory below SP, like the code the VM translator emits:
+    - a push of D immediately followed by a pop to D is removed, when the next
+      instruction loads A anyway.
+    - a push of D immediately followed by the pop of a binary operation becomes a plain
+      access of the stack top.
+    - loading A with the value it already holds is removed.
+    a program that jumps to numeric ROM addresses is returned as is, as removing any
+    instruction would move its jump targets. only a jump right after loading the number
+    (@123 / 0;JMP) is detected: a ROM address kept as a number in memory and jumped to
+    later (@123 / D=A / @R14 / M=D ... @R14 / A=M / 0;JMP) is not, and such a program
+    must not be optimized.
+
+    Returns:
+        typing.TextIO: the optimized program, seekable, to be assembled instead of the input.
+        int: the number of instructions removed.
+    """
+    commands = read_commands(input_file)
+    if _jumps_to_numeric_addresses(commands):
+        return io.StringIO("\n".join(commands)), 0
+    optimized = peephole(remove_unreachable_blocks(thread_jumps(commands)))
+    return io.StringIO("\n".join(optimized)), count_instructions(commands) - count_instructions(optimized)
+
+
+def read_commands(input_file: typing.TextIO) -> typing.List[str]:
+    """
+    returns all the cleaned commands (instructions and labels) of the file
+    """
+    par = Parser(input_file)
+    commands = []
+    while par.has_more_commands():
+        par.advance()
+        commands.append(par.cur_command)
+    return commands
+
+
+def count_instructions(commands: typing.List[str]) -> int:
+    """labels are not instructions, as they take no ROM word"""
+    return sum(1 for command in commands if not command.startswith(L_PREFIX))
+
+
+def peephole(commands: typing.List[str]) -> typing.List[str]:
+    """
+    applies the rewrite rules until nothing changes
+    """
+    for i in range(MAX_ROUNDS):
+        optimized = _remove_redundant_a_loads(_fuse_push_pop(commands))
+        if len(optimized) == len(commands):
+            return optimized
+        commands = optimized
+    return commands
+
+
+def thread_jumps(commands: typing.List[str]) -> typing.List[str]:
+    """
+    makes every jump to a label whose first instruction is an unconditional jump
+    (@Yyy / 0;JMP) go straight to the end of the chain. A still holds the final
+    target when it is reached, exactly as if the chain was followed. only a jump that
+    uses A for nothing but its target is retargeted (0;JMP, D;JGT), not one that also
+    stores or tests A or M (D=A;JMP, M;JNE)
+    """
+    label_index = _label_indices(commands)
+    threaded = list(commands)
+    for i in range(len(commands) - 1):
+        if not commands[i].startswith(A_PREFIX) or not _is_plain_jump(commands[i + 1]):
+            continue
+        target = commands[i][1:]
+        visited = set()
+        while target in label_index and target not in visited:
+            visited.add(target)
+            next_target = _unconditional_jump_target(commands, label_index[target])
+            if next_target is None:
+                break
+            target = next_target
+        threaded[i] = A_PREFIX + target
+    return threaded
+
+
+def remove_unreachable_blocks(commands: typing.List[str]) -> typing.List[str]:
+    """
+    splits the program into basic blocks (starting at labels and after jumps) and removes
+    the blocks that can't be reached. a block is reachable if it is the first one, if a
+    reachable block falls through into it, or if its label is loaded into A (@Xxx) by a
+    reachable block - which covers jumps as well as addresses kept as data, like return
+    addresses
+    """
+    blocks = _split_blocks(commands)
+    block_of_label = dict()
+    for block_ind, block in enumerate(blocks):
+        for command in block:
+            if command.startswith(L_PREFIX):
+                block_of_label[command[1:-1]] = block_ind
+
+    reachable = set()
+    pending = [0] if blocks else []
+    while pending:
+        block_ind = pending.pop()
+        if block_ind in reachable:
+            continue
+        reachable.add(block_ind)
+        block = blocks[block_ind]
+        for command in block:
+            if command.startswith(A_PREFIX) and command[1:] in block_of_label:
+                pending.append(block_of_label[command[1:]])
+        if block_ind + 1 < len(blocks) and not _ends_with_unconditional_jump(block):
+            pending.append(block_ind + 1)
+
+    return [command for block_ind, block in enumerate(blocks) if block_ind in reachable for command in block]
+
+
+def _split_blocks(commands: typing.List[str]) -> typing.List[typing.List[str]]:
+    """
+    a block is a run of labels followed by straight-line instructions, ending at a jump
+    """
+    blocks = []
+    block = []
+    for command in commands:
+        if command.startswith(L_PREFIX) and any(not cmd.startswith(L_PREFIX) for cmd in block):
+            blocks.append(block)
+            block = []
+        block.append(command)
+        if _is_jump(command):
+            blocks.append(block)
+            block = []
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def _label_indices(commands: typing.List[str]) -> typing.Dict[str, int]:
+    """
+    maps every label to the index of the first instruction after it
+    """
+    label_index = dict()
+    waiting_labels = []
+    for i, command in enumerate(commands):
+        if command.startswith(L_PREFIX):
+            waiting_labels.append(command[1:-1])
+            continue
+        for label in waiting_labels:
+            label_index[label] = i
+        waiting_labels = []
+    for label in waiting_labels:
+        label_index[label] = len(commands)
+    return label_index
+
+
+def _unconditional_jump_target(commands: typing.List[str], index: int) -> typing.Optional[str]:
+    """
+    returns Yyy if the instructions at index are @Yyy / 0;JMP (with no dest), None otherwise
+    """
+    if index + 1 >= len(commands) or not commands[index].startswith(A_PREFIX):
+        return None
+    jump = commands[index + 1]
+    if not _is_jump(jump) or "=" in jump or jump.partition(JUMP_SEPARATOR)[2] != UNCONDITIONAL_JUMP:
+        return None
+    return commands[index][1:]
+
+
+def _jumps_to_numeric_addresses(commands: typing.List[str]) -> bool:
+    """
+    is there a jump right after loading A with a number rather than a label?
+    """
+    for i in range(len(commands) - 1):
+        if commands[i].startswith(A_PREFIX) and commands[i][1:].isdigit() and _is_jump(commands[i + 1]):
+            return True
+    return False
+
+
+def _is_jump(command: str) -> bool:
+    return JUMP_SEPARATOR in command
+
+
+def _is_plain_jump(command: str) -> bool:
+    """is it a jump with no dest, whose comp reads neither A nor M?"""
+    comp = command.partition(JUMP_SEPARATOR)[0]
+    return _is_jump(command) and "=" not in comp and "A" not in comp and "M" not in comp
+
+
+def _ends_with_unconditional_jump(block: typing.List[str]) -> bool:
+    return _is_jump(block[-1]) and block[-1].partition(JUMP_SEPARATOR)[2] == UNCONDITIONAL_JUMP
+
+
+def _fuse_push_pop(commands: typing.List[str]) -> typing.List[str]:
+    """
+    rewrites the windows of a push of D followed by a pop
+    """
+    optimized = []
+    i = 0
+    while i < len(commands):
+        push_len = _match_push_d(commands, i)
+        if push_len:
+            after_push = i + push_len
+            if _matches(commands, after_push, POP_D_TO_BINARY_OP):
+                # D keeps the pushed value and A points at the top - the same state after the pop
+                optimized.extend(TOP_ADDRESS)
+                i = after_push + len(POP_D_TO_BINARY_OP)
+                continue
+            after_pop = after_push + len(POP_D)
+            if _matches(commands, after_push, POP_D) and \
+                    (after_pop == len(commands) or commands[after_pop].startswith(A_PREFIX)):
+                # D keeps the pushed value, SP is back where it was and A is overwritten next
+                i = after_pop
+                continue
+        optimized.append(commands[i])
+        i += 1
+    return optimized
+
+
+def _remove_redundant_a_loads(commands: typing.List[str]) -> typing.List[str]:
+    """
+    removes @Xxx when A already holds Xxx: it was loaded earlier in the same straight-line
+    code, with no label since (that could be jumped to) and no C-command writing A
+    """
+    optimized = []
+    a_value = None
+    for command in commands:
+        if command.startswith(A_PREFIX):
+            if command == a_value:
+                continue
+            a_value = command
+        elif command.startswith(L_PREFIX) or _writes_a(command):
+            a_value = None
+        optimized.append(command)
+    return optimized
+
+
+def _match_push_d(commands: typing.List[str], index: int) -> int:
+    """returns the length of the push of D starting at index, 0 if there isn't one"""
+    for push in PUSH_D:
+        if _matches(commands, index, push):
+            return len(push)
+    return 0
+
+
+def _writes_a(command: str) -> bool:
+    dest, equals, comp = command.partition("=")
+    return bool(equals) and "A" in dest
+
+
+def _matches(commands: typing.List[str], index: int, window: typing.List[str]) -> bool:
+    return commands[index:index + len(window)] == window
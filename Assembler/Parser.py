@@ -23,18 +23,26 @@ class Parser:
     comments.
     """
 
-    def __init__(self, input_file: typing.TextIO) -> None:
+    def __init__(self, input_file: typing.TextIO, stream: bool = False) -> None:
         """Opens the input file and gets ready to parse it.
 
         Args:
             input_file (typing.TextIO): input file.
+            stream (bool): if True, the lines are read lazily one by one instead
+            of reading the whole file up front. A streaming parser can only be
+            used for a single pass over the file.
         """
-        input_lines = input_file.read().splitlines() # getting an array of the file lines
+        if stream:
+            self.__input_file = input_file
+            input_lines = []
+        else:
+            self.__input_file = None
+            input_lines = input_file.read().splitlines() # getting an array of the file lines
 
         self.lines = input_lines
+        self.__pending_line = None
         self.__next_valid_command = None
         self.cur_command = None
-        self.__command_ind = 0
 
 
     def has_more_commands(self) -> bool:
@@ -48,6 +56,9 @@ class Parser:
         # if next_valid != None && next_valid < len(lines) -> runner++ and keep check from there
         # if next_valid == len(lines) -> return False
 
+        if self.__input_file is not None:
+            return self.__read_next_valid_line()
+
         if self.__next_valid_command == len(self.lines): #TODO check if comparison is correct
             return False
 
@@ -71,8 +82,24 @@ class Parser:
         Should be called only if has_more_commands() is true.
         Also cleans the next valid command if exists
         """
-        self.cur_command = cleanCommand(self.lines[self.__next_valid_command])
-        self.__command_ind = 0
+        if self.__input_file is not None:
+            self.cur_command = cleanCommand(self.__pending_line)
+        else:
+            self.cur_command = cleanCommand(self.lines[self.__next_valid_command])
+
+
+    def __read_next_valid_line(self) -> bool:
+        """
+        streaming mode only: reads lines from the input file until a valid command is found
+        and keeps it for the next call to advance()
+        """
+        for line in self.__input_file:
+            line = line.rstrip("\n")
+            if _isValidCommand(line):
+                self.__pending_line = line
+                return True
+        self.__pending_line = None
+        return False
 
 
     def command_type(self) -> str:
@@ -113,17 +140,11 @@ class Parser:
             str: the dest mnemonic in the current C-command. Should be called
             only when commandType() is "C_COMMAND".
         """
-        des = ""
         if self.command_type() != C_COMMAND:
             raise TypeError("The symbol func is not valid for C_COMMANDS") #TODO check if needed
 
-        for ch in self.cur_command:
-            if ch == "=":
-                return des
-            des += ch
-            self.__command_ind += 1
-        self.__command_ind = 0
-        return ""
+        dest, equals, comp = self.cur_command.partition("=")
+        return dest if equals else ""
 
 
     def comp(self) -> str:
@@ -132,18 +153,11 @@ class Parser:
             str: the comp mnemonic in the current C-command. Should be called
             only when commandType() is "C_COMMAND".
         """
-        comp = ""
-        if self.__command_ind != len(self.cur_command) and self.cur_command[self.__command_ind] == "=":
-            self.__command_ind += 1
-
         if self.command_type() != C_COMMAND:
             raise TypeError("The symbol func is not valid for C_COMMANDS") #TODO check if needed
-        for ch in self.cur_command[self.__command_ind:]:
-            self.__command_ind += 1
-            if ch == ";":
-                break
-            comp += ch
-        return comp
+
+        dest, equals, comp = self.cur_command.rpartition("=")
+        return comp.partition(";")[0]
 
 
     def jump(self) -> str:
@@ -152,9 +166,7 @@ class Parser:
             str: the jump mnemonic in the current C-command. Should be called
             only when commandType() is "C_COMMAND".
         """
-        if self.__command_ind == len(self.cur_command):
-            return ""
-        return self.cur_command[self.__command_ind:]
+        return self.cur_command.partition(";")[2]
 
     def is_shift(self) -> bool:
         if RIGHT_SHIFT in self.cur_command or LEFT_SHIFT in self.cur_command:
@@ -0,0 +1,101 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import re
+import typing
+
+L_PREFIX = "("
+ROM_SIZE = 32768
+DEFAULT_TOP = 20
+START_REGION = "(start)"    # the code before the first label, e.g. the bootstrap code
+# the labels of the comparisons of CodeWriter, written inside the calling function: the
+# return labels of the shared comparisons, and the labels of the inline comparisons
+COMPARE_RETURN_LABEL = re.compile(r"^(EQ|GT|LT)\d+(_[A-Z_]+)?$")
+
+# The size map of a program tells where its ROM words went. It has the address range of
+# every label, and the size of every region the program splits into: a region starts at a
+# VM function label (Xxx.yyy) and also takes the labels CodeWriter writes inside the
+# function (Xxx.yyy$label, Xxx.yyy$ret.N, EQN/GTN/LTN...). any other label (hand written code,
+# the shared comparison code) starts a region of its own.
+
+
+def label_ranges(commands: typing.List[str]) -> typing.List[typing.Tuple[str, int, int]]:
+    """
+    Returns:
+        list: (label, first address, address after the last one) for every label, by address.
+        the range of a label ends where the next label starts.
+    """
+    labels = []
+    address = 0
+    for command in commands:
+        if command.startswith(L_PREFIX):
+            labels.append((command[1:-1], address))
+        else:
+            address += 1
+    ranges = []
+    for i, (label, start) in enumerate(labels):
+        end = labels[i + 1][1] if i + 1 < len(labels) else address
+        ranges.append((label, start, end))
+    return ranges
+
+
+def region_sizes(commands: typing.List[str]) -> typing.List[typing.Tuple[str, int, int]]:
+    """
+    Returns:
+        list: (region name, first address, address after the last one) for every
+        non-empty region, by address.
+    """
+    regions = []
+    name, start = START_REGION, 0
+    address = 0
+    for command in commands:
+        if not command.startswith(L_PREFIX):
+            address += 1
+            continue
+        label = command[1:-1]
+        if _belongs_to_function(label):
+            continue
+        if address > start:
+            regions.append((name, start, address))
+        name, start = label, address
+    if address > start:
+        regions.append((name, start, address))
+    return regions
+
+
+def write_size_map(commands: typing.List[str], output_file: typing.TextIO, top: int = DEFAULT_TOP) -> None:
+    """
+    writes the size map of the given commands (instructions and labels, as read by the
+    Parser) to output_file
+    """
+    total = sum(1 for command in commands if not command.startswith(L_PREFIX))
+    regions = region_sizes(commands)
+    output_file.write(f"ROM words: {total} of {ROM_SIZE} ({100 * total / ROM_SIZE:.1f}%)\n")
+    if total > ROM_SIZE:
+        output_file.write(f"over the ROM size by {total - ROM_SIZE} words\n")
+
+    output_file.write(f"\nlargest {min(top, len(regions))} of {len(regions)} regions:\n")
+    largest = sorted(regions, key=lambda region: (region[1] - region[2], region[1]))[:top]
+    for name, start, end in largest:
+        output_file.write(f"{end - start:8} {100 * (end - start) / max(total, 1):6.2f}%  {name}\n")
+
+    output_file.write("\nregions:\n")
+    for name, start, end in regions:
+        output_file.write(f"{_address_range(start, end)} {end - start:8}  {name}\n")
+
+    output_file.write("\nlabels:\n")
+    for label, start, end in label_ranges(commands):
+        output_file.write(f"{_address_range(start, end)} {end - start:8}  {label}\n")
+
+
+def _belongs_to_function(label: str) -> bool:
+    return "$" in label or COMPARE_RETURN_LABEL.match(label) is not None
+
+
+def _address_range(start: int, end: int) -> str:
+    if end > start:
+        return f"{start:6}-{end - 1:<6}"
+    return f"{start:6} {'':6}"
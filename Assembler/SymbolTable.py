@@ -21,7 +21,7 @@ class SymbolTable:
         and their pre-allocated RAM addresses, according to section 6.2.3 of the
         book.
         """
-        self.table = PREDEFINED_DICT
+        self.table = dict(PREDEFINED_DICT)  # a copy, so symbols never leak between tables
 
     def add_entry(self, symbol: str, address: int) -> None:
         """Adds the pair (symbol, address) to the table.
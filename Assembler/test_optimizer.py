@@ -0,0 +1,44 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import io
+import unittest
+import Optimizer
+
+HOP_TO_END = ["(HOP)", "@END", "0;JMP", "(END)", "@END", "0;JMP"]
+
+
+def optimized_commands(commands):
+    output, removed = Optimizer.optimize(io.StringIO("\n".join(commands)))
+    return output.read().split("\n")
+
+
+class ThreadJumpsTest(unittest.TestCase):
+
+    def test_plain_jumps_are_threaded(self):
+        for jump in ("0;JMP", "D;JGT", "D+1;JNE"):
+            commands = ["@HOP", jump] + HOP_TO_END
+            self.assertEqual(Optimizer.thread_jumps(commands)[0], "@END", jump)
+
+    def test_jumps_using_a_or_m_keep_their_target(self):
+        # the jump also stores or tests A (or M), so A must still hold HOP's address
+        for jump in ("D=A;JMP", "M=D;JMP", "D-A;JGT", "M;JNE", "AM=M-1;JEQ"):
+            commands = ["@HOP", jump] + HOP_TO_END
+            self.assertEqual(Optimizer.thread_jumps(commands)[0], "@HOP", jump)
+            self.assertEqual(optimized_commands(commands)[:2], ["@HOP", jump], jump)
+
+
+class NumericJumpsTest(unittest.TestCase):
+
+    def test_program_jumping_to_a_number_is_not_optimized(self):
+        commands = ["@4", "0;JMP", "@SP", "@SP", "(LOOP)", "@LOOP", "0;JMP"]
+        self.assertTrue(Optimizer._jumps_to_numeric_addresses(commands))
+        self.assertEqual(Optimizer.optimize(io.StringIO("\n".join(commands)))[1], 0)
+        self.assertEqual(optimized_commands(commands), commands)
+
+
+if "__main__" == __name__:
+    unittest.main()
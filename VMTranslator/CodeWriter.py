@@ -27,6 +27,8 @@ TEMP = "temp"
 
 STATIC_START = 16
 TEMP_START = 5
+SMALL_CONSTANTS = (-1, 0, 1)    # computed by the ALU, with no A-instruction
+MAX_INCREMENTED_INDEX = 2       # up to this index, segment addresses are reached with A=A+1
 
 TRUE = "-1"
 FALSE = "0"
@@ -35,6 +37,86 @@ TAB = "    "
 NL = "\n"
 
 SEGMENTS_TO_RESTORE = {1: "THAT", 2:"THIS", 3:"ARG", 4:"LCL"}
+FRAME_SIZE = 5      # the return address and the saved LCL, ARG, THIS and THAT
+COUNTERS_START = 24577      # the call counters of the instrumented functions, right above KBD
+COUNTERS_END = 32768
+
+OPTIMIZE_SIZE = "size"      # comparisons jump to the general EQ/GT/LT blocks
+OPTIMIZE_SPEED = "speed"    # comparisons are written inline
+
+# the computations of the commands that keep the stack top cached in D: D holds y (the
+# top) and M is x (the entry below it), the result stays cached in D
+CACHED_BINARY = {ADD: "D=D+M", SUB: "D=M-D", AND: "D=D&M", OR: "D=D|M"}
+CACHED_UNARY = {NEG: "D=-D", NOT: "D=!D", SHIFT_L: "D=D<<", SHIFT_R: "D=D>>"}
+# the computations of the commands written with batched SP updates, in place on the stack:
+# D holds y (the top) and M is x for the binary commands, M is the top for the unary ones
+BATCHED_BINARY = {ADD: "M=D+M", SUB: "M=M-D", AND: "M=D&M", OR: "M=D|M"}
+BATCHED_UNARY = {NEG: "M=-M", NOT: "M=!M", SHIFT_L: "M=M<<", SHIFT_R: "M=M>>"}
+MAX_SP_OFFSET = 3   # further stack slots are not addressed from SP, SP is updated first
+MAX_UNROLLED_LOCALS = 8     # more local variables are zeroed by the general ZERO_LOCALS loop
+
+# the general routines written at the end of the file, in this order, when jumped to
+ROUTINES = ("EQ", "GT", "LT", "CALL", "RETURN", "ZERO_LOCALS")
+
+BUFFER_SIZE = 4096      # pieces of code collected before they are written to the output stream
+
+# the code of the plain commands, by shape. the stack templates are filled in per segment
+# entry with the {base} pointer and {index} of the entry, its {address}, or the {value}
+# of a constant (the code loading it into D for a large constant)
+SEGMENT_ENTRY = "segment"
+SMALL_CONSTANT = "small constant"
+ARITHMETIC_TEMPLATES = {
+    ADD: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "A=A-1" + NL + "M=M+D" + NL,
+    SUB: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "A=A-1" + NL + "M=M-D" + NL,
+    AND: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "A=A-1" + NL + "M=D&M" + NL,
+    OR: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "A=A-1" + NL + "M=D|M" + NL,
+    NEG: "@SP" + NL + "A=M-1" + NL + "M=-M" + NL,
+    NOT: "@SP" + NL + "A=M-1" + NL + "M=!M" + NL,
+    SHIFT_L: "@SP" + NL + "A=M-1" + NL + "M=M<<" + NL,
+    SHIFT_R: "@SP" + NL + "A=M-1" + NL + "M=M>>" + NL,
+}
+PUSH_TEMPLATES = {
+    SMALL_CONSTANT: "@SP" + NL + "M=M+1" + NL + "A=M-1" + NL + "M={value}" + NL,
+    CONSTANT: "{value}@SP" + NL + "A=M" + NL + "M=D" + NL + "@SP" + NL + "M=M+1" + NL,
+    SEGMENT_ENTRY: "@{base}" + NL + "D=M" + NL + "@{index}" + NL + "A=D+A" + NL + "D=M" + NL +
+                   "@SP" + NL + "A=M" + NL + "M=D" + NL + "@SP" + NL + "M=M+1" + NL,
+    TEMP: "@{address}" + NL + "D=M" + NL + "@SP" + NL + "A=M" + NL + "M=D" + NL + "@SP" + NL + "M=M+1" + NL,
+    POINTER: "@{address}" + NL + "D=M" + NL + "@SP" + NL + "M=M+1" + NL + "A=M-1" + NL + "M=D" + NL,
+    STATIC: "@{address}" + NL + "D=M" + NL + "@SP" + NL + "M=M+1" + NL + "A=M-1" + NL + "M=D" + NL,
+}
+POP_TEMPLATES = {
+    SEGMENT_ENTRY: "@{base}" + NL + "D=M" + NL + "@{index}" + NL + "D=D+A" + NL + "@R13" + NL + "M=D" + NL +
+                   "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "@R13" + NL + "A=M" + NL + "M=D" + NL,
+    TEMP: "@{base}" + NL + "D=A" + NL + "@{index}" + NL + "D=D+A" + NL + "@R13" + NL + "M=D" + NL +
+          "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "@R13" + NL + "A=M" + NL + "M=D" + NL,
+    POINTER: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "@{address}" + NL + "M=D" + NL,
+    STATIC: "@SP" + NL + "AM=M-1" + NL + "D=M" + NL + "@{address}" + NL + "M=D" + NL,
+}
+
+
+class CodeBuffer:
+    """
+    Collects the code written by a CodeWriter, and writes it to the output stream in bulk.
+    A stream that takes the pieces as they are (a HackWriter, see write_pieces) gets them
+    without joining them into text.
+    """
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        self.output_stream = output_stream
+        self.pieces = []
+        self.write = self.pieces.append
+        self.write_pieces = getattr(output_stream, "write_pieces", None)
+
+    def flush(self) -> None:
+        """
+        writes the collected code to the output stream
+        """
+        if self.pieces:
+            if self.write_pieces is not None:
+                self.write_pieces(self.pieces)
+            else:
+                self.output_stream.write("".join(self.pieces))
+            self.pieces.clear()
 
 
 class CodeWriter:
@@ -45,17 +127,55 @@ class CodeWriter:
     LT = 2
     INIT_FUNC = "Sys.init"
 
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    def __init__(self, output_stream: typing.TextIO, shared_calls: bool = False,
+                 optimize: str = OPTIMIZE_SIZE, cache_top: bool = False, batch_sp: bool = False,
+                 namespace: str = "", counters: typing.Optional[typing.Dict[str, int]] = None,
+                 comments: bool = True, small_constants: bool = False) -> None:
         """Initializes the CodeWriter.
 
         Args:
             output_stream (typing.TextIO): output stream.
+            shared_calls (bool): if True, every call and every return jumps to a single
+            general CALL / RETURN routine written at the end of the file, instead of
+            inlining the frame handling.
+            optimize (str): OPTIMIZE_SIZE or OPTIMIZE_SPEED, see the constants.
+            cache_top (bool): if True, the stack top is kept in D between commands when
+            possible. the top is then "popped": SP points at the entry it belongs in, and it
+            is written back (flushed) before labels, jumps, calls, returns and the commands
+            that have no cached form.
+            batch_sp (bool): if True, the pushes, pops and arithmetic commands of straight-line
+            code address the stack as SP+k and update SP once, at the end of the block (before
+            labels, jumps, calls, returns and comparisons). can't be combined with cache_top.
+            namespace (str): if given, the labels this writer makes up (comparison and
+            return labels) are scoped by it, so code written by writers with different
+            namespaces can be linked together.
+            counters (dict): function name -> RAM address of its call counter (between
+            COUNTERS_START and COUNTERS_END). if given, every function increments its counter
+            when it is entered.
+            comments (bool): if False, no comments are written, only code.
+            small_constants (bool): if True, the plain pushes of the constants -1, 0 and 1
+            write them with M=-1/0/1 (see SMALL_CONSTANTS), like the fused commands do.
         """
-        self.output = output_stream
+        if cache_top and batch_sp:
+            raise ValueError("the stack top can't be cached with batched SP updates")
+        self.output = CodeBuffer(output_stream)   # flushed to the stream by flush and fill_missing_functions
         self.__compare_index = [0, 0, 0]  # [EQ, GT, LT]
         self.__cur_file_name = None
         self.__cur_func = ""
         self.__functions_returns = dict()
+        self.__shared_calls = shared_calls
+        self.__used_routines = set()    # see ROUTINES
+        self.__namespace = namespace
+        self.__optimize = optimize
+        self.__cache_top = cache_top
+        self.__top_in_d = False
+        self.__batch_sp = batch_sp
+        self.__sp_offset = 0    # the stack top is at SP+offset, SP is not updated yet
+        self.__counters = counters
+        self.__comments = comments
+        self.__small_constants = small_constants
+        self.__push_snippets = dict()   # (segment, index) or (static, index, file) -> code
+        self.__pop_snippets = dict()
 
     def set_file_name(self, filename: str) -> None:
         """Informs the code writer that the translation of a new VM file is
@@ -70,8 +190,8 @@ class CodeWriter:
         """
         initializes the .asm file with the initial commands (calling sys.init) and sets the stack
         """
-        self.output.write("// initializing stack & calling Sys.init" + NL +
-                          "@256" + NL +
+        self.__comment("initializing stack & calling Sys.init")
+        self.output.write("@256" + NL +
                           "D=A" + NL +
                           "@SP" + NL +
                           "M=D" + NL)
@@ -85,28 +205,22 @@ class CodeWriter:
         Args:
             command (str): an arithmetic command.
         """
-        if command == ADD:
-            self.__add(command)
-        if command == SUB:
-            self.__sub(command)
-        if command == NEG:
-            self.__neg(command)
+        if self.__cache_top and (command in CACHED_BINARY or command in CACHED_UNARY):
+            self.__cached_arithmetic(command)
+            return
+        if self.__batch_sp and (command in BATCHED_BINARY or command in BATCHED_UNARY):
+            self.__batched_arithmetic(command)
+            return
+        self.__flush_stack()
+        if command in ARITHMETIC_TEMPLATES:
+            self.__comment(command)
+            self.output.write(ARITHMETIC_TEMPLATES[command])
         if command == EQ:
             self.__eq(command)
         if command == GT:
             self.__gt(command)
         if command == LT:
             self.__lt(command)
-        if command == AND:
-            self.__and(command)
-        if command == OR:
-            self.__or(command)
-        if command == NOT:
-            self.__not(command)
-        if command == SHIFT_L:
-            self.__shift_left(command)
-        if command == SHIFT_R:
-            self.__shift_right(command)
 
 
     def write_push_pop(self, command: str, segment: str, index: int) -> None:
@@ -118,6 +232,19 @@ class CodeWriter:
             segment (str): the memory segment to operate on.
             index (int): the index in the memory segment.
         """
+        if self.__batch_sp:
+            if command == "C_PUSH":
+                self.__batched_push("push", segment, index)
+            else:
+                self.__batched_pop("pop", segment, index)
+            return
+        if self.__cache_top and command == "C_PUSH":
+            self.__cached_push("push", segment, index)
+            return
+        if self.__top_in_d and not (segment in SEGMENTS and index > MAX_INCREMENTED_INDEX):
+            self.__cached_pop("pop", segment, index)
+            return
+        self.__flush_top()
         if command == "C_PUSH":
             self.__push("push", segment, index)
         else:
@@ -126,6 +253,16 @@ class CodeWriter:
 
     def write_branching(self, command:str, label:str):
         label = f"{self.__cur_func}${label}"
+        if command == "C_IF" and self.__top_in_d:
+            self.__comment(f"if-goto {label}")
+            self.output.write(f"@{label}" + NL +
+                              "D;JNE" + NL)
+            self.__top_in_d = False
+            return
+        if command == "C_IF" and self.__batch_sp:
+            self.__batched_if_goto("if-goto", label)
+            return
+        self.__flush_stack()
         if command == "C_GOTO":
             self.__goto("goto", label)
         elif command == "C_IF":
@@ -141,6 +278,9 @@ class CodeWriter:
         @func_name function name
         @n number of args or vars, according to the given command type
         """
+        self.__flush_stack()
+        if len(self.output.pieces) >= BUFFER_SIZE:
+            self.output.flush()
         if command == "C_FUNCTION":
             self.__function("function", func_name, n)
         else:
@@ -148,248 +288,511 @@ class CodeWriter:
 
 
     def write_return(self, command:str):
+        self.__flush_stack()
         self.__return("return")
 
-#========================================= functions implementations ==========================================
 
-    def __add(self, command: str):
+    def write_add_constant(self, value: int) -> None:
         """
-        translates 'add' command from VM to ASM
+        writes the fused 'push constant c / add' (value = c) or 'push constant c / sub'
+        (value = -c): the constant is added to the stack top in place
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "AM=M-1" + NL +
-                          "D=M" + NL +
-                          "A=A-1" + NL +
-                          "M=M+D" + NL)
-
-
-    def __sub(self, command: str):
+        self.__comment(f"add constant {value}")
+        if value == 0:
+            return
+        if self.__top_in_d:
+            self.__add_constant_to_d(value)
+            return
+        if value in SMALL_CONSTANTS:
+            self.__stack_slot_address(-1)
+            self.output.write(f"M=M{value:+}" + NL)
+            return
+        self.__load_constant(value)
+        self.__stack_slot_address(-1)
+        self.output.write("M=D+M" + NL)
+
+
+    def write_move(self, source: typing.Tuple[str, int], destination: typing.Tuple[str, int]) -> None:
         """
-        translates 'sub' command from VM to ASM
+        writes the fused 'push source / pop destination': the value is copied from one
+        segment to the other without going through the stack
+
+        Args:
+            source (tuple): (segment, index) to push from, may be the constant segment.
+            destination (tuple): (segment, index) to pop to.
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "AM=M-1" + NL +
-                          "D=M" + NL +
-                          "A=A-1" + NL +
-                          "M=M-D" + NL)
+        source_segment, source_index = source
+        destination_segment, destination_index = destination
+        self.__comment(f"push {source_segment} {source_index} / pop {destination_segment} {destination_index}")
+        if source == destination:
+            return
+        self.__flush_top()
+
+        # the destination address is computed into R13 first, unless it can be reached without D
+        indirect = destination_segment in SEGMENTS and destination_index > MAX_INCREMENTED_INDEX
+        if indirect:
+            self.output.write(f"@{SEGMENTS[destination_segment]}" + NL +
+                              "D=M" + NL +
+                              f"@{destination_index}" + NL +
+                              "D=D+A" + NL +
+                              "@R13" + NL +
+                              "M=D" + NL)
+
+        if source_segment == CONSTANT:
+            self.__load_constant(source_index)
+        else:
+            self.__address(source_segment, source_index)
+            self.output.write("D=M" + NL)
 
+        if indirect:
+            self.output.write("@R13" + NL +
+                              "A=M" + NL)
+        else:
+            self.__address(destination_segment, destination_index)
+        self.output.write("M=D" + NL)
 
-    def __neg(self, command: str):
+    def write_tail_call(self, function_name: str, num_args: int, caller_num_args: int) -> None:
         """
-        translates 'neg' command from VM to ASM
+        writes the fused 'call function_name num_args / return': the callee reuses the frame
+        of the current function instead of pushing a new one, so it returns straight to our
+        caller. the arguments are popped into our own arguments, the frame is moved down
+        right above them when the callee has fewer arguments than we have, and the callee
+        starts with an empty stack at LCL
+
+        Args:
+            function_name (str): the called function.
+            num_args (int): the number of arguments of the call.
+            caller_num_args (int): the number of arguments of the current function, at least
+            num_args.
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "A=M-1" + NL +
-                          "M=-M" + NL)
+        self.__comment(f"tail call {function_name} {num_args}")
+        for index in reversed(range(num_args)):
+            self.write_push_pop("C_POP", "argument", index)
+        self.__flush_stack()
+
+        distance = caller_num_args - num_args
+        if distance:
+            # the frame words are copied upwards in memory order, each to a lower address
+            self.output.write(f"@{distance}" + NL +
+                              "D=A" + NL +
+                              "@LCL" + NL +
+                              "M=M-D" + NL)
+            for position in range(FRAME_SIZE, 0, -1):    # the frame word at LCL-position
+                offset = distance - position
+                self.output.write("@LCL" + NL +
+                                  "D=M" + NL +
+                                  f"@{abs(offset)}" + NL +
+                                  ("A=D+A" if offset >= 0 else "A=D-A") + NL +
+                                  "D=M" + NL +
+                                  "@LCL" + NL +
+                                  "A=M-1" + NL +
+                                  ("A=A-1" + NL) * (position - 1) +
+                                  "M=D" + NL)
+        self.output.write("@LCL" + NL +
+                          "D=M" + NL +
+                          "@SP" + NL +
+                          "M=D" + NL +
+                          f"@{function_name}" + NL +
+                          "0;JMP" + NL)
 
+#========================================= functions implementations ==========================================
 
     def __eq(self, command: str):
         """
         initialize a jump to the 'eq' command written at the end of the asm file, and saves a label to return to al R13
         """
-        self.output.write(f"// {command}" + NL)
+        self.__comment(f"{command}")
         self.__compare_index[CodeWriter.EQ] += 1
-        self.output.write(f"@EQ{self.__compare_index[CodeWriter.EQ]}" +
-                          f"    // EQ{self.__compare_index[CodeWriter.EQ]}" + NL +
+        label = self.__compare_label("EQ", CodeWriter.EQ)
+        if self.__optimize == OPTIMIZE_SPEED:
+            self.__inline_eq(label)
+            return
+        self.__used_routines.add("EQ")
+        self.output.write(f"@{label}" + NL +
                           "D=A" + NL +
                           "@R13" + NL +
                           "M=D" + NL +
                           "@EQ" + NL +
                           "0;JMP" + NL +
-                          f"(EQ{self.__compare_index[CodeWriter.EQ]})" +
-                          f"    // EQ{self.__compare_index[CodeWriter.EQ]} label" + NL)
+                          f"({label})" + NL)
 
 
     def __gt(self, command):
         """
         initialize a jump to the 'gt' command written at the end of the asm file, and saves a label to return to al R13
         """
-        self.output.write(f"// {command}" + NL)
+        self.__comment(f"{command}")
         self.__compare_index[CodeWriter.GT] += 1
-        self.output.write(f"@GT{self.__compare_index[CodeWriter.GT]}" +
-                          f"    // GT{self.__compare_index[CodeWriter.GT]}" + NL +
+        label = self.__compare_label("GT", CodeWriter.GT)
+        if self.__optimize == OPTIMIZE_SPEED:
+            self.__inline_compare(label, "JGT")
+            return
+        self.__used_routines.add("GT")
+        self.output.write(f"@{label}" + NL +
                           "D=A" + NL +
                           "@R13" + NL +
                           "M=D" + NL +
                           "@GT" + NL +
                           "0;JMP" + NL +
-                          f"(GT{self.__compare_index[CodeWriter.GT]})" +
-                          f"    // GT{self.__compare_index[CodeWriter.GT]} label" + NL)
+                          f"({label})" + NL)
 
 
     def __lt(self, command):
         """
         initialize a jump to the 'lt' command written at the end of the asm file, and saves a label to return to al R13
         """
-        self.output.write(f"// {command}" + NL)
+        self.__comment(f"{command}")
         self.__compare_index[CodeWriter.LT] += 1
-        self.output.write(f"@LT{self.__compare_index[CodeWriter.LT]}" +
-                          f"    // LT{self.__compare_index[CodeWriter.LT]}" + NL +
+        label = self.__compare_label("LT", CodeWriter.LT)
+        if self.__optimize == OPTIMIZE_SPEED:
+            self.__inline_compare(label, "JLT")
+            return
+        self.__used_routines.add("LT")
+        self.output.write(f"@{label}" + NL +
                           "D=A" + NL +
                           "@R13" + NL +
                           "M=D" + NL +
                           "@LT" + NL +
                           "0;JMP" + NL +
-                          f"(LT{self.__compare_index[CodeWriter.LT]})" +
-                          f"    // LT{self.__compare_index[CodeWriter.LT]} label" + NL)
+                          f"({label})" + NL)
 
 
-    def __and(self, command):
+    def __inline_eq(self, label: str):
         """
-        translates 'and' command from VM to ASM
+        writes 'eq' inline: x - y is 0 exactly when x == y, even if the subtraction overflows
         """
-        self.output.write(f"// {command}" + NL)
         self.output.write("@SP" + NL +
                           "AM=M-1" + NL +
                           "D=M" + NL +
                           "A=A-1" + NL +
-                          "M=D&M" + NL)
+                          "D=M-D" + NL +
+                          f"M={TRUE}" + NL +
+                          f"@{label}" + NL +
+                          "D;JEQ" + NL +
+                          "@SP" + NL +
+                          "A=M-1" + NL +
+                          f"M={FALSE}" + NL +
+                          f"({label})" + NL)
 
 
-    def __or(self, command):
+    def __inline_compare(self, label: str, jump: str):
         """
-        translates 'or' command from VM to ASM
+        writes 'gt' (jump = JGT) or 'lt' (jump = JLT) inline. the result is decided by the
+        sign of D: x - y when x and y have the same sign (so it can't overflow), otherwise
+        a value with the sign of x
         """
-        self.output.write(f"// {command}" + NL)
         self.output.write("@SP" + NL +
                           "AM=M-1" + NL +
-                          "D=M" + NL +
-                          "A=A-1" + NL +
-                          "M=D|M" + NL)
+                          "D=M" + NL +                  # D = y
+                          f"@{label}_Y_NEG" + NL +
+                          "D;JLT" + NL +
+                          "@SP" + NL +
+                          "A=M-1" + NL +
+                          "D=M" + NL +                  # D = x
+                          f"@{label}_DECIDE" + NL +
+                          "D;JLT" + NL +                # x < 0 <= y
+                          "@SP" + NL +
+                          "A=M" + NL +
+                          "D=D-M" + NL +                # 0 <= x, y
+                          f"@{label}_DECIDE" + NL +
+                          "0;JMP" + NL +
+                          f"({label}_Y_NEG)" + NL +
+                          "@SP" + NL +
+                          "A=M-1" + NL +
+                          "D=M" + NL +                  # D = x
+                          f"@{label}_X_POS" + NL +
+                          "D;JGE" + NL +
+                          "@SP" + NL +
+                          "A=M" + NL +
+                          "D=D-M" + NL +                # x, y < 0
+                          f"@{label}_DECIDE" + NL +
+                          "0;JMP" + NL +
+                          f"({label}_X_POS)" + NL +
+                          "D=1" + NL +                  # y < 0 <= x
+                          f"({label}_DECIDE)" + NL +
+                          "@SP" + NL +
+                          "A=M-1" + NL +
+                          f"M={TRUE}" + NL +
+                          f"@{label}" + NL +
+                          f"D;{jump}" + NL +
+                          "@SP" + NL +
+                          "A=M-1" + NL +
+                          f"M={FALSE}" + NL +
+                          f"({label})" + NL)
 
 
-    def __not(self, command):
+    def __push(self, command, segment, index):
         """
-        translates 'not' command from VM to ASM
+        translates 'push' command from VM to ASM according to the given segment and given index
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "A=M-1" + NL +
-                          "M=!M" + NL)
+        self.__comment(f"{command} {segment} {index}")
+        key = (segment, index, self.__cur_file_name) if segment == STATIC else (segment, index)
+        code = self.__push_snippets.get(key)
+        if code is None:
+            code = self.__push_snippets[key] = self.__render(PUSH_TEMPLATES, segment, index)
+        self.output.write(code)
 
 
-    def __shift_left(self, command):
+    def __render(self, templates: dict, segment: str, index: int) -> str:
         """
-        translates 'shiftleft' command from VM to ASM
+        fills in the push or pop template of the given segment entry
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "A=M-1" + NL +
-                          "M=M<<" + NL)
+        if segment == CONSTANT and self.__small_constants and index in SMALL_CONSTANTS:
+            return templates[SMALL_CONSTANT].format(value=index)
+        if segment == CONSTANT:
+            return templates[CONSTANT].format(value=constant_loader(index, self.__small_constants))
+        if segment in SEGMENTS:
+            return templates[SEGMENT_ENTRY].format(base=SEGMENTS[segment], index=index)
+        if segment == TEMP:
+            return templates[TEMP].format(base=TEMP_START, index=index, address=TEMP_START + index)
+        if segment == POINTER:
+            return templates[POINTER].format(address=POINTERS[index])
+        return templates[STATIC].format(address=f"{self.__cur_file_name}.{index}")
 
 
-    def __shift_right(self, command):
+    def __flush_stack(self):
         """
-        translates 'shiftright' command from VM to ASM
+        brings the stack to its plain form - all entries in RAM and SP up to date - at the
+        end of a block
         """
-        self.output.write(f"// {command}" + NL)
-        self.output.write("@SP" + NL +
-                          "A=M-1" + NL +
-                          "M=M>>" + NL)
+        self.__flush_top()
+        self.__flush_sp()
 
 
-    def __push(self, command, segment, index):
+    def __flush_sp(self):
         """
-        translates 'push' command from VM to ASM according to the given segment and given index
+        applies the pending SP update of the batched commands, D is lost
         """
-        self.output.write(f"// {command} {segment} {index}" + NL)
-
-        if segment == CONSTANT:
-            self.output.write(f"@{index}" + NL +
-                              "D=A" + NL +
-                              "@SP" + NL +
-                              "A=M" + NL +
-                              "M=D" + NL +
-                              "@SP" + NL +
-                              "M=M+1" + NL)
+        offset = self.__sp_offset
+        self.__sp_offset = 0
+        if offset in SMALL_CONSTANTS:
+            if offset:
+                self.output.write("@SP" + NL +
+                                  f"M=M{offset:+}" + NL)
+            return
+        self.output.write(f"@{abs(offset)}" + NL +
+                          "D=A" + NL +
+                          "@SP" + NL +
+                          ("M=D+M" if offset > 0 else "M=M-D") + NL)
 
-        elif segment in SEGMENTS:
-            self.output.write(f"@{SEGMENTS[segment]}" + NL +
-                              "D=M" + NL +
-                              f"@{index}" + NL +
-                              "A=D+A" + NL +
-                              "D=M" + NL +
-                              "@SP" + NL +
-                              "A=M" + NL +
-                              "M=D" + NL +
-                              "@SP" + NL +
-                              "M=M+1" + NL)
 
-        elif segment == TEMP:
-            self.output.write(f"@{TEMP_START + index}" + NL +
-                              "D=M" + NL +
-                              "@SP" + NL +
-                              "A=M" + NL +
-                              "M=D" + NL +
-                              "@SP" + NL +
-                              "M=M+1" + NL)
+    def __stack_slot_address(self, slot: int):
+        """
+        sets A to the address of the stack entry at the given slot relative to the top:
+        0 is where the next push goes, -1 is the top. D is kept
+        """
+        position = self.__sp_offset + slot
+        self.output.write("@SP" + NL)
+        if position == 0:
+            self.output.write("A=M" + NL)
+        elif position > 0:
+            self.output.write("A=M+1" + NL +
+                              ("A=A+1" + NL) * (position - 1))
+        else:
+            self.output.write("A=M-1" + NL +
+                              ("A=A-1" + NL) * (-position - 1))
 
-        elif segment == POINTER:
-            self.output.write(f"@{POINTERS[index]}" + NL +
-                              "D=M" + NL +
-                              "@SP" + NL +
-                              "M=M+1" + NL +
-                              "A=M-1" + NL +
-                              "M=D" + NL)
 
-        elif segment == STATIC:
-            self.output.write(f"@{self.__cur_file_name}.{index}" + NL +
-                              "D=M" + NL +
-                              "@SP" + NL +
-                              "M=M+1" + NL +
-                              "A=M-1" + NL +
-                              "M=D" + NL)
+    def __batched_push(self, command, segment, index):
+        """
+        pushes to SP+offset, without updating SP
+        """
+        self.__comment(f"{command} {segment} {index}")
+        if self.__sp_offset >= MAX_SP_OFFSET:
+            self.__flush_sp()
+        if segment == CONSTANT and index in SMALL_CONSTANTS:
+            self.__stack_slot_address(0)
+            self.output.write(f"M={index}" + NL)
+        else:
+            if segment == CONSTANT:
+                self.__load_constant(index)
+            else:
+                self.__address(segment, index)
+                self.output.write("D=M" + NL)
+            self.__stack_slot_address(0)
+            self.output.write("M=D" + NL)
+        self.__sp_offset += 1
 
 
-    def __pop(self, command, segment, index):
+    def __batched_pop(self, command, segment, index):
         """
-        translates 'pop' command from VM to ASM according to the given segment and given index
+        pops from SP+offset, without updating SP
         """
-        self.output.write(f"// {command} {segment} {index}" + NL)
-        if segment in SEGMENTS:
+        self.__comment(f"{command} {segment} {index}")
+        if self.__sp_offset <= -MAX_SP_OFFSET:
+            self.__flush_sp()
+        indirect = segment in SEGMENTS and index > MAX_INCREMENTED_INDEX
+        if indirect:
             self.output.write(f"@{SEGMENTS[segment]}" + NL +
                               "D=M" + NL +
                               f"@{index}" + NL +
                               "D=D+A" + NL +
                               "@R13" + NL +
-                              "M=D" + NL +
-                              "@SP" + NL +
-                              "AM=M-1" + NL +
-                              "D=M" + NL +
-                              "@R13" + NL +
-                              "A=M" + NL +
                               "M=D" + NL)
+        self.__stack_slot_address(-1)
+        self.output.write("D=M" + NL)
+        if indirect:
+            self.output.write("@R13" + NL +
+                              "A=M" + NL)
+        else:
+            self.__address(segment, index)
+        self.output.write("M=D" + NL)
+        self.__sp_offset -= 1
 
-        elif segment == TEMP:
-            self.output.write(f"@{TEMP_START}" + NL +
-                              "D=A" + NL +
-                              f"@{index}" + NL +
-                              "D=D+A" + NL +
-                              "@R13" + NL +
-                              "M=D" + NL +
-                              "@SP" + NL +
-                              "AM=M-1" + NL +
-                              "D=M" + NL +
-                              "@R13" + NL +
-                              "A=M" + NL +
+
+    def __batched_arithmetic(self, command: str):
+        """
+        translates the arithmetic commands that have a batched form, in place on the stack
+        """
+        self.__comment(f"{command}")
+        if self.__sp_offset <= -MAX_SP_OFFSET:
+            self.__flush_sp()
+        self.__stack_slot_address(-1)
+        if command in BATCHED_UNARY:
+            self.output.write(BATCHED_UNARY[command] + NL)
+            return
+        self.output.write("D=M" + NL +
+                          "A=A-1" + NL +
+                          BATCHED_BINARY[command] + NL)
+        self.__sp_offset -= 1
+
+
+    def __batched_if_goto(self, command: str, label: str):
+        """
+        pops the condition while applying the pending SP update, and jumps on it
+        """
+        self.__comment(f"{command} {label}")
+        self.__sp_offset -= 1
+        if self.__sp_offset == -1:
+            self.__sp_offset = 0
+            self.output.write("@SP" + NL +
+                              "AM=M-1" + NL)
+        else:
+            self.__flush_sp()
+            self.output.write("@SP" + NL +
+                              "A=M" + NL)
+        self.output.write("D=M" + NL +
+                          f"@{label}" + NL +
+                          "D;JNE" + NL)
+
+
+    def __flush_top(self):
+        """
+        writes the stack top cached in D back to the stack, if it is cached
+        """
+        if self.__top_in_d:
+            self.output.write("@SP" + NL +
+                              "M=M+1" + NL +
+                              "A=M-1" + NL +
                               "M=D" + NL)
+            self.__top_in_d = False
 
-        elif segment == POINTER:
+
+    def __load_top(self):
+        """
+        pops the stack top into D, if it is not cached there already
+        """
+        if not self.__top_in_d:
             self.output.write("@SP" + NL +
                               "AM=M-1" + NL +
-                              "D=M" + NL +
-                              f"@{POINTERS[index]}" + NL +
-                              "M=D" + NL)
+                              "D=M" + NL)
+            self.__top_in_d = True
 
-        elif segment == STATIC:
+
+    def __cached_arithmetic(self, command: str):
+        """
+        translates the arithmetic commands that have a cached form, keeping the result in D
+        """
+        self.__comment(f"{command}")
+        self.__load_top()
+        if command in CACHED_UNARY:
+            self.output.write(CACHED_UNARY[command] + NL)
+        else:
             self.output.write("@SP" + NL +
                               "AM=M-1" + NL +
-                              "D=M" + NL +
-                              f"@{self.__cur_file_name}.{index}" + NL +
-                              "M=D" + NL)
+                              CACHED_BINARY[command] + NL)
+
+
+    def __cached_push(self, command, segment, index):
+        """
+        pushes by writing the previous top back to the stack and loading the new one to D
+        """
+        self.__comment(f"{command} {segment} {index}")
+        self.__flush_top()
+        if segment == CONSTANT:
+            self.__load_constant(index)
+        else:
+            self.__address(segment, index)
+            self.output.write("D=M" + NL)
+        self.__top_in_d = True
+
+
+    def __cached_pop(self, command, segment, index):
+        """
+        pops the top cached in D straight to its destination, which must be reachable
+        without D (see __address)
+        """
+        self.__comment(f"{command} {segment} {index}")
+        self.__address(segment, index)
+        self.output.write("M=D" + NL)
+        self.__top_in_d = False
+
+
+    def __add_constant_to_d(self, value: int):
+        if value in SMALL_CONSTANTS:
+            self.output.write(f"D=D{value:+}" + NL)
+        elif value == -32768:
+            self.output.write("@32767" + NL +
+                              "D=D-A" + NL +
+                              "D=D-1" + NL)
+        elif value < 0:
+            self.output.write(f"@{-value}" + NL +
+                              "D=D-A" + NL)
+        else:
+            self.output.write(f"@{value}" + NL +
+                              "D=D+A" + NL)
+
+
+    def __load_constant(self, value: int):
+        """
+        sets D to the given constant, which may be negative
+        """
+        self.output.write(constant_loader(value))
+
+
+    def __address(self, segment, index):
+        """
+        sets A to the address of the given segment entry. D is kept, except for the
+        local/argument/this/that entries above MAX_INCREMENTED_INDEX
+        """
+        if segment in SEGMENTS:
+            if index <= MAX_INCREMENTED_INDEX:
+                self.output.write(f"@{SEGMENTS[segment]}" + NL +
+                                  "A=M" + NL +
+                                  ("A=A+1" + NL) * index)
+            else:
+                self.output.write(f"@{SEGMENTS[segment]}" + NL +
+                                  "D=M" + NL +
+                                  f"@{index}" + NL +
+                                  "A=D+A" + NL)
+        elif segment == TEMP:
+            self.output.write(f"@{TEMP_START + index}" + NL)
+        elif segment == POINTER:
+            self.output.write(f"@{POINTERS[index]}" + NL)
+        elif segment == STATIC:
+            self.output.write(f"@{self.__cur_file_name}.{index}" + NL)
+
+
+    def __pop(self, command, segment, index):
+        """
+        translates 'pop' command from VM to ASM according to the given segment and given index
+        """
+        self.__comment(f"{command} {segment} {index}")
+        key = (segment, index, self.__cur_file_name) if segment == STATIC else (segment, index)
+        code = self.__pop_snippets.get(key)
+        if code is None:
+            code = self.__pop_snippets[key] = self.__render(POP_TEMPLATES, segment, index)
+        self.output.write(code)
 
 
     def __goto(self, command:str, label: str):
@@ -397,7 +800,7 @@ class CodeWriter:
         writes goto command
         @label label to go to
         """
-        self.output.write(f"// {command} {label}" + NL)
+        self.__comment(f"{command} {label}")
         self.output.write(f"@{label}" + NL +
                           "0;JMP" + NL)
 
@@ -407,7 +810,7 @@ class CodeWriter:
         writes if-goto command
         @label label to go to
         """
-        self.output.write(f"// {command} {label}" + NL)
+        self.__comment(f"{command} {label}")
         self.output.write("@SP" + NL +
                           "AM=M-1" + NL +
                           "D=M" + NL +
@@ -420,7 +823,7 @@ class CodeWriter:
         writes label command
         @label label to go to
         """
-        self.output.write(f"// {command} {label}" + NL)
+        self.__comment(f"{command} {label}")
         self.output.write(f"({label})" + NL)
 
 
@@ -432,10 +835,41 @@ class CodeWriter:
         @num_local_vars number of local args to push
         """
         self.__cur_func = function_name
-        self.output.write(f"// {command} {function_name} {num_local_vars}" + NL)
+        self.__comment(f"{command} {function_name} {num_local_vars}")
         self.output.write(f"({function_name})" + NL)
-        for i in range(num_local_vars):
+        if self.__counters is not None and function_name in self.__counters:
+            self.output.write(f"@{self.__counters[function_name]}" + NL +
+                              "M=M+1" + NL)    # the call counter
+        if num_local_vars == 0:
+            return
+        if num_local_vars == 1:
             self.__push("push", "constant", 0)
+        elif num_local_vars <= MAX_UNROLLED_LOCALS or self.__optimize == OPTIMIZE_SPEED:
+            self.__zero_locals(num_local_vars)
+        else:
+            self.__used_routines.add("ZERO_LOCALS")
+            self.output.write(f"@{function_name}$ret.locals" + NL +
+                              "D=A" + NL +
+                              "@R13" + NL +
+                              "M=D" + NL +
+                              f"@{num_local_vars}" + NL +
+                              "D=A" + NL +
+                              "@ZERO_LOCALS" + NL +
+                              "0;JMP" + NL +
+                              f"({function_name}$ret.locals)" + NL)
+
+
+    def __zero_locals(self, num_local_vars):
+        """
+        pushes num_local_vars zeros (at least 2) with a single update of SP
+        """
+        self.output.write("@SP" + NL +
+                          "A=M" + NL +
+                          "M=0" + NL +
+                          ("A=A+1" + NL + "M=0" + NL) * (num_local_vars - 1) +
+                          "D=A+1" + NL +
+                          "@SP" + NL +
+                          "M=D" + NL)
 
 
     def __call(self, command, function_name, num_args):
@@ -449,9 +883,27 @@ class CodeWriter:
             self.__functions_returns[function_name] = 0
         else:
             self.__functions_returns[function_name] += 1
+        return_label = self.__return_label(function_name)
 
-        self.output.write(f"// {command} {function_name} {num_args}" + NL)
-        self.output.write(f"@{function_name}$ret.{self.__functions_returns[function_name]}" + NL +
+        self.__comment(f"{command} {function_name} {num_args}")
+        if self.__shared_calls:
+            self.__used_routines.add("CALL")
+            self.output.write(f"@{return_label}" + NL +
+                              "D=A" + NL +
+                              "@R15" + NL +
+                              "M=D" + NL +      # R15 = return address
+                              f"@{num_args}" + NL +
+                              "D=A" + NL +
+                              "@R14" + NL +
+                              "M=D" + NL +      # R14 = num_args
+                              f"@{function_name}" + NL +
+                              "D=A" + NL +      # D = function address, kept by CALL in R13
+                              "@CALL" + NL +
+                              "0;JMP" + NL)
+            self.output.write(f"({return_label})" + NL)
+            return
+
+        self.output.write(f"@{return_label}" + NL +
                           "D=A" + NL +
                           "@SP" + NL +
                           "M=M+1" + NL +
@@ -483,7 +935,7 @@ class CodeWriter:
                           "M=D" + NL)    #up to here- setting LCL to SP
 
         self.__goto("goto", function_name)
-        self.output.write(f"({function_name}$ret.{self.__functions_returns[function_name]})")
+        self.output.write(f"({return_label})" + NL)
 
 
     def __return(self, command):
@@ -491,8 +943,19 @@ class CodeWriter:
         write return function
         @command command type
         """
-        self.output.write(f"// {command}" + NL)
+        self.__comment(f"{command}")
+        if self.__shared_calls:
+            self.__used_routines.add("RETURN")
+            self.output.write("@RETURN" + NL +
+                              "0;JMP" + NL)
+            return
+        self.__write_return_frame()
 
+
+    def __write_return_frame(self):
+        """
+        writes the restoring of the caller's frame and the jump back to it
+        """
         self.output.write("@LCL" + NL +
                           "D=M" + NL +
                           "@R14" + NL +
@@ -551,7 +1014,7 @@ class CodeWriter:
         """
         writes the general 'eq' command to be jumped to from __eq
         """
-        self.output.write(NL + "// GENERAL EQ" + NL)
+        self.__comment("GENERAL EQ", heading=True)
         self.output.write("@END" + NL +
                           "0;JMP" + NL + NL +
                           "(EQ)" + NL +
@@ -603,7 +1066,7 @@ class CodeWriter:
         """
         writes the general 'gt' command to be jumped to from __gt
         """
-        self.output.write(NL + "// GENERAL GT" + NL)
+        self.__comment("GENERAL GT", heading=True)
         self.output.write("@END" + NL +
                           "0;JMP" + NL + NL +
                           "(GT)" + NL +
@@ -665,7 +1128,7 @@ class CodeWriter:
         """
         writes the general 'lt' command to be jumped to from __lt
         """
-        self.output.write(NL + "// GENERAL LT" + NL)
+        self.__comment("GENERAL LT", heading=True)
         self.output.write("@END" + NL +
                           "0;JMP" + NL + NL +
                           "(LT)" + NL +
@@ -723,21 +1186,158 @@ class CodeWriter:
                           TAB + "0;JMP" + NL)
 
 
+    def __write_general_call(self):
+        """
+        writes the general 'call' command to be jumped to from __call, with the return
+        address at R15, the number of arguments at R14 and the function address at D
+        """
+        self.__comment("GENERAL CALL", heading=True)
+        self.output.write("@END" + NL +
+                          "0;JMP" + NL + NL +
+                          "(CALL)" + NL +
+                          TAB + "@R13" + NL +
+                          TAB + "M=D" + NL +            # R13 = function address
+                          TAB + "@R15" + NL +
+                          TAB + "D=M" + NL +
+                          TAB + "@SP" + NL +
+                          TAB + "M=M+1" + NL +
+                          TAB + "A=M-1" + NL +
+                          TAB + "M=D" + NL)             # push return address
+
+        for segment in ["LCL", "ARG", "THIS", "THAT"]:
+            self.output.write(TAB + "@" + segment + NL +
+                              TAB + "D=M" + NL +
+                              TAB + "@SP" + NL +
+                              TAB + "M=M+1" + NL +
+                              TAB + "A=M-1" + NL +
+                              TAB + "M=D" + NL)
+
+        self.output.write(TAB + "@SP" + NL +
+                          TAB + "D=M" + NL +
+                          TAB + "@LCL" + NL +
+                          TAB + "M=D" + NL +            # LCL = SP
+                          TAB + "@R14" + NL +
+                          TAB + "D=D-M" + NL +
+                          TAB + "@5" + NL +
+                          TAB + "D=D-A" + NL +
+                          TAB + "@ARG" + NL +
+                          TAB + "M=D" + NL +            # ARG = SP - 5 - num_args
+                          TAB + "@R13" + NL +
+                          TAB + "A=M" + NL +
+                          TAB + "0;JMP" + NL)           # jump to the function
+
+
+    def __write_general_zero_locals(self):
+        """
+        writes the general zeroing of the local variables to be jumped to from __function,
+        with the number of local variables at D and the return address at R13
+        """
+        self.__comment("GENERAL ZERO LOCALS", heading=True)
+        self.output.write("@END" + NL +
+                          "0;JMP" + NL + NL +
+                          "(ZERO_LOCALS)" + NL +
+                          TAB + "@SP" + NL +
+                          TAB + "AM=M+1" + NL +
+                          TAB + "A=A-1" + NL +
+                          TAB + "M=0" + NL +            # push 0
+                          TAB + "D=D-1" + NL +
+                          TAB + "@ZERO_LOCALS" + NL +
+                          TAB + "D;JGT" + NL +
+                          TAB + "@R13" + NL +
+                          TAB + "A=M" + NL +
+                          TAB + "0;JMP" + NL)
+
+
+    def __write_general_return(self):
+        """
+        writes the general 'return' command to be jumped to from __return
+        """
+        self.__comment("GENERAL RETURN", heading=True)
+        self.output.write("@END" + NL +
+                          "0;JMP" + NL + NL +
+                          "(RETURN)" + NL)
+        self.__write_return_frame()
+
+
     def fill_missing_functions(self):
         """
         adding all missing functions that we want to jump to at the end of the file.
-        adding only those among: eq, gt, lt that we actually used
-        """
-        used_comparison = False
-        if self.__compare_index[CodeWriter.EQ]:
-            used_comparison = True
-            self.__write_general_eq()
-        if self.__compare_index[CodeWriter.GT]:
-            used_comparison = True
-            self.__write_general_gt()
-        if self.__compare_index[CodeWriter.LT]:
-            used_comparison = True
-            self.__write_general_lt()
-        if used_comparison:
+        adding only those among: eq, gt, lt, call, return, zero locals that we actually used
+        """
+        self.__flush_stack()
+        writers = {"EQ": self.__write_general_eq, "GT": self.__write_general_gt, "LT": self.__write_general_lt,
+                   "CALL": self.__write_general_call, "RETURN": self.__write_general_return,
+                   "ZERO_LOCALS": self.__write_general_zero_locals}
+        for routine in ROUTINES:
+            if routine in self.__used_routines:
+                writers[routine]()
+        if self.__used_routines:
             self.output.write("(END)" + NL)
+        self.output.flush()
+
+
+    def used_routines(self) -> typing.FrozenSet[str]:
+        """
+        Returns:
+            frozenset: the general routines (see ROUTINES) the code written so far jumps to.
+        """
+        return frozenset(self.__used_routines)
+
 
+    def add_used_routines(self, routines: typing.Iterable[str]) -> None:
+        """
+        marks general routines as used by code written by other writers, so that
+        fill_missing_functions writes them too
+        """
+        self.__used_routines.update(routines)
+
+
+    def flush(self) -> None:
+        """
+        writes back the stack state kept in registers, so that the code written so far
+        ends with the stack in RAM and SP up to date, and writes all the code to the output
+        stream
+        """
+        self.__flush_stack()
+        self.output.flush()
+
+
+    def __comment(self, text: str, heading: bool = False):
+        """
+        writes a comment line (after an empty line for a heading), unless comments are off
+        """
+        if self.__comments:
+            self.output.write((NL if heading else "") + "// " + text + NL)
+
+
+    def __compare_label(self, kind: str, kind_index: int) -> str:
+        """
+        the label of the latest comparison of the given kind, scoped by the namespace
+        """
+        label = f"{kind}{self.__compare_index[kind_index]}"
+        if self.__namespace:
+            return f"{self.__namespace}${label}"
+        return label
+
+
+    def __return_label(self, function_name: str) -> str:
+        """
+        the return label of the latest call of the given function, scoped by the namespace
+        """
+        if self.__namespace:
+            return f"{function_name}$ret.{self.__namespace}.{self.__functions_returns[function_name]}"
+        return f"{function_name}$ret.{self.__functions_returns[function_name]}"
+
+
+def constant_loader(value: int, small_constants: bool = True) -> str:
+    """
+    the code that sets D to the given constant, which may be negative. the constants -1, 0
+    and 1 are computed by the ALU, unless small_constants is False
+    """
+    if small_constants and value in SMALL_CONSTANTS:
+        return f"D={value}" + NL
+    if value == -32768:
+        return "@32767" + NL + "D=!A" + NL
+    if value < 0:
+        return f"@{-value}" + NL + "D=-A" + NL
+    return f"@{value}" + NL + "D=A" + NL
@@ -0,0 +1,243 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import array
+import os
+import sys
+import typing
+
+# the encoding (including the shift extension) and the predefined symbols are the assembler's
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Assembler"))
+from Code import Code
+from SymbolTable import PREDEFINED_DICT
+
+HACK_EXTENSION = ".hack"
+BINARY_EXTENSION = ".bin"
+SYMBOL_MAP_EXTENSION = ".sym"
+COMMENT = "//"
+NL = "\n"
+VARIABLES_START = 16
+ROM_SIZE = 32768
+MAX_A_VALUE = 0x7FFF    # an A-instruction holds a 15 bit value, bit 15 marks a C-instruction
+WORD_TYPECODE = "H"     # unsigned 16 bit
+
+# the encoded lines
+WORD = 0        # (WORD, encoded instruction)
+SYMBOL = 1      # (SYMBOL, name) - an A-command resolved when the program is complete
+LABEL = 2       # (LABEL, name) - a label of the next instruction
+SOURCE = 3      # (SOURCE, comment) - a comment line, kept for the symbol map
+EMPTY = 4       # (EMPTY, None) - an empty line
+
+
+class HackWriter:
+    """
+    Writes the code of a CodeWriter directly as Hack machine code, without an .asm file
+    and a run of the assembler over it.
+    It is passed to the CodeWriter in place of the output file. CodeWriter writes the code
+    of every command from the same few templates and snippets, and hands over these pieces
+    as they are (see write_pieces): every distinct piece is encoded once into its words,
+    and written again by extending the program with them, with no text split or parsed.
+    Plain .asm text (like the fragments linked by the parallel translation) is accepted
+    as well. The predefined symbols are resolved as they are encoded, the labels are
+    resolved and the variables allocated (from RAM 16, by order of first use, like the
+    assembler) when the writer is closed. a program that doesn't fit in the ROM, or an A-instruction
+    value that doesn't fit in 15 bits, is an error: no broken ROM image is written.
+    """
+
+    def __init__(self, output_file: typing.IO, binary: bool = False,
+                 symbol_map_file: typing.Optional[typing.TextIO] = None) -> None:
+        """
+        Args:
+            output_file (typing.IO): the output file, opened for text writing, or for
+            binary writing if binary is True.
+            binary (bool): if True, the program is written as packed little-endian
+            16 bit words, otherwise as a .hack text file.
+            symbol_map_file (typing.TextIO): if given, the ROM address of every label and
+            every VM command, and the RAM address of every variable are written to it.
+        """
+        self.output = output_file
+        self.binary = binary
+        self.symbol_map_file = symbol_map_file
+        self.words = []
+        self.labels = dict()
+        self.references = []   # (word index, symbol) of the A-commands waiting for the labels
+        self.source_map = []    # (ROM address, label or comment) for the symbol map
+        self.__encoded_pieces = dict()  # piece -> (words, references, marks), see __encode_piece
+        self.__encoded_lines = dict()   # line -> (kind, value), see encode_line
+        self.__partial_line = ""
+
+    def write(self, text: str) -> None:
+        """
+        encodes the complete lines of the given text. a line that is not complete yet is
+        kept until the rest of it is written
+        """
+        text = self.__partial_line + text
+        end = text.rfind(NL) + 1
+        self.__partial_line = text[end:]
+        if end:
+            self.__write_lines(text[:end])
+
+    def write_pieces(self, pieces: typing.Iterable[str]) -> None:
+        """
+        writes the pieces of code collected by a CodeWriter, each made of complete lines.
+        a piece is encoded the first time it is met, and taken from its encoding after that
+        """
+        words = self.words
+        encoded_pieces = self.__encoded_pieces
+        partial_line = self.__partial_line
+        for piece in pieces:
+            encoded = encoded_pieces.get(piece)
+            if encoded is None or partial_line:
+                if partial_line or not piece.endswith(NL):
+                    self.write(piece)
+                    partial_line = self.__partial_line
+                    continue
+                encoded = encoded_pieces[piece] = self.__encode_piece(piece)
+            piece_words, references, marks = encoded
+            base = len(words)
+            words.extend(piece_words)
+            if references:
+                for offset, symbol in references:
+                    self.references.append((base + offset, symbol))
+            if marks:
+                self.__mark(base, marks)
+
+    def close(self) -> None:
+        """
+        resolves the labels and variables, writes the program (and the symbol map) and
+        closes the output files. raises ValueError if the program doesn't fit in the ROM
+        """
+        try:
+            if self.__partial_line:
+                self.__write_lines(self.__partial_line)
+                self.__partial_line = ""
+            if len(self.words) > ROM_SIZE:
+                raise ValueError(f"the program is {len(self.words)} words long, it doesn't fit in "
+                                 f"the {ROM_SIZE} words of the ROM")
+            symbols = dict(PREDEFINED_DICT)
+            symbols.update(self.labels)
+            variables = dict()
+            for index, symbol in self.references:
+                if symbol not in symbols:
+                    symbols[symbol] = variables[symbol] = VARIABLES_START + len(variables)
+                if symbols[symbol] > MAX_A_VALUE:
+                    raise ValueError(f"@{symbol} is {symbols[symbol]}, it doesn't fit in an A-instruction")
+                self.words[index] = symbols[symbol]
+        except ValueError:
+            self.__close_files()
+            raise
+
+        if self.binary:
+            words = array.array(WORD_TYPECODE, self.words)
+            if sys.byteorder == "big":
+                words.byteswap()
+            words.tofile(self.output)
+        else:
+            self.output.write("".join(format(word, "016b") + NL for word in self.words))
+        self.output.close()
+
+        if self.symbol_map_file is not None:
+            for address, entry in self.source_map:
+                self.symbol_map_file.write(f"{address:6}  {entry}" + NL)
+            for symbol, address in variables.items():
+                self.symbol_map_file.write(f"{address:6}  @{symbol}" + NL)
+            self.symbol_map_file.close()
+
+    def __enter__(self) -> "HackWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.__close_files()
+
+    def __close_files(self) -> None:
+        """
+        closes the output files without writing the program
+        """
+        self.output.close()
+        if self.symbol_map_file is not None:
+            self.symbol_map_file.close()
+
+    def __write_lines(self, text: str) -> None:
+        """
+        writes the words of the given complete lines
+        """
+        piece_words, references, marks = self.__encode_piece(text)
+        base = len(self.words)
+        self.words.extend(piece_words)
+        self.references.extend((base + offset, symbol) for offset, symbol in references)
+        self.__mark(base, marks)
+
+    def __mark(self, base: int, marks: typing.Tuple[tuple, ...]) -> None:
+        """
+        records the labels (and the comments, for the symbol map) of a piece written at base
+        """
+        for offset, kind, value in marks:
+            if kind == LABEL:
+                self.labels[value] = base + offset
+                if self.symbol_map_file is not None:
+                    self.source_map.append((base + offset, f"({value})"))
+            elif self.symbol_map_file is not None:
+                self.source_map.append((base + offset, value))
+
+    def __encode_piece(self, piece: str) -> typing.Tuple[tuple, tuple, tuple]:
+        """
+        encodes complete lines of Hack assembly, every distinct line once, into:
+            words (tuple): the instruction words, 0 for the A-commands of symbols.
+            references (tuple): (offset, symbol) of the A-commands resolved when the
+            program is complete.
+            marks (tuple): (offset, LABEL, name) and (offset, SOURCE, comment).
+        """
+        words, references, marks = [], [], []
+        for line in piece.splitlines():
+            encoded = self.__encoded_lines.get(line)
+            if encoded is None:
+                encoded = self.__encoded_lines[line] = encode_line(line)
+            kind, value = encoded
+            if kind == WORD:
+                words.append(value)
+            elif kind == SYMBOL:
+                references.append((len(words), value))
+                words.append(0)
+            elif kind == LABEL or kind == SOURCE:
+                marks.append((len(words), kind, value))
+        return tuple(words), tuple(references), tuple(marks)
+
+
+def encode_line(line: str) -> typing.Tuple[int, typing.Any]:
+    """
+    encodes a line of Hack assembly (see WORD, SYMBOL, LABEL, SOURCE and EMPTY)
+    """
+    line = line.strip()
+    if line.startswith(COMMENT):
+        return SOURCE, line
+    comment_idx = line.find(COMMENT)
+    if comment_idx != -1:
+        line = line[:comment_idx]
+    line = line.replace(" ", "").replace("\t", "")
+    if not line:
+        return EMPTY, None
+    if line[0] == "(":
+        return LABEL, line[1:-1]
+    if line[0] == "@":
+        if line[1:].isdigit():
+            if int(line[1:]) > MAX_A_VALUE:
+                raise ValueError(f"@{line[1:]} doesn't fit in an A-instruction")
+            return WORD, int(line[1:])
+        if line[1:] in PREDEFINED_DICT:
+            return WORD, PREDEFINED_DICT[line[1:]]
+        return SYMBOL, line[1:]
+    return WORD, c_command(line)
+
+
+def c_command(command: str) -> int:
+    """
+    Returns:
+        int: the encoded C-command, as the assembler encodes it.
+    """
+    return Code.c_command_word(command)
@@ -4,86 +4,314 @@ https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
 and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0 
 Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
+import io
+import json
 import os
-import sys
 import typing
-from Parser import Parser
-from CodeWriter import CodeWriter
+from Parser import Parser, COMMAND_TYPES, SEGMENT_NAMES, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, \
+    C_FUNCTION, C_RETURN, C_CALL
+from CodeWriter import CodeWriter, OPTIMIZE_SIZE, OPTIMIZE_SPEED, COUNTERS_START, COUNTERS_END
+from HackWriter import HackWriter, HACK_EXTENSION, BINARY_EXTENSION, SYMBOL_MAP_EXTENSION
+import Optimizer
 
+ASM_FORMAT = "asm"
+HACK_FORMAT = "hack"
+BINARY_FORMAT = "bin"
 
-def translate_file(input_file: typing.TextIO, coder: CodeWriter) -> None:
+
+def translate_file(input_file: typing.TextIO, coder: CodeWriter, fuse: bool = False) -> None:
     """Translates a single file.
 
     Args:
         input_file (typing.TextIO): the file to translate.
-        output_file (typing.TextIO): writes all output to this file.
+        coder (CodeWriter): writes all output through this code writer.
+        fuse (bool): if True, common sequences of commands are fused before they are
+        written, see Optimizer.fuse.
     """
     input_filename, input_extension = os.path.splitext(os.path.basename(input_file.name))
-    coder.set_file_name(input_filename)
-    parser = Parser(input_file)
+    translate_commands(input_filename, parse_file(input_file), coder, fuse)
 
-    while parser.has_more_commands():
-        parser.advance()
-        send_command(parser, coder)
 
+def parse_file(input_file: typing.TextIO) -> typing.List[Optimizer.Command]:
+    """
+    returns all the parsed commands of the file, and closes it
+    """
+    commands = list(Parser(input_file).commands())
     input_file.close()
+    return commands
+
+
+def translate_commands(filename: str, commands: typing.List[Optimizer.Command], coder: CodeWriter,
+                       fuse: bool = False) -> None:
+    """
+    translates the parsed commands of the file with the given name (without extension),
+    see translate_file
+    """
+    coder.set_file_name(filename)
+    if fuse:
+        commands = Optimizer.fuse(commands)
+    for command in commands:
+        if (command.opcode == C_PUSH or command.opcode == C_POP) and command.symbol:
+            # a static of another file, in the body of a function inlined from it
+            coder.set_file_name(command.symbol)
+            send_command(command, coder)
+            coder.set_file_name(filename)
+        else:
+            send_command(command, coder)
+
+
+
+def translate_unit(filename: str, commands: typing.List[Optimizer.Command], writer_options: dict,
+                   fuse: bool = False) -> typing.Tuple[str, typing.FrozenSet[str]]:
+    """
+    translates one file on its own, into an asm fragment whose made up labels are scoped by
+    the file name, so it can run in a worker process independently of the other files
+
+    Args:
+        filename (str): the name of the file, without extension.
+        commands (list): the parsed commands of the file.
+        writer_options (dict): keyword arguments for the CodeWriter.
+        fuse (bool): see translate_file.
+
+    Returns:
+        str: the asm fragment.
+        frozenset: the general routines the fragment jumps to.
+    """
+    fragment = io.StringIO()
+    coder = CodeWriter(fragment, namespace=filename, **writer_options)
+    translate_commands(filename, commands, coder, fuse)
+    coder.flush()
+    return fragment.getvalue(), coder.used_routines()
+
+
+def link(output_file: typing.TextIO, units: typing.List[typing.Tuple[str, typing.FrozenSet[str]]],
+         writer_options: dict) -> None:
+    """
+    writes the bootstrap, the fragments made by translate_unit in the given order and the
+    general routines that any of them jumps to
+    """
+    coder = CodeWriter(output_file, **writer_options)
+    coder.write_init()
+    coder.flush()
+    for fragment, routines in units:
+        output_file.write(fragment)
+        coder.add_used_routines(routines)
+    coder.fill_missing_functions()
+
 
+def translate_in_parallel(output_file: typing.TextIO,
+                          files: typing.List[typing.Tuple[str, typing.List[Optimizer.Command]]],
+                          jobs: int, writer_options: dict, fuse: bool = False) -> None:
+    """
+    translates the files on a pool of `jobs` worker processes and links the results in the
+    order of the files, so the output doesn't depend on which worker finishes first
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(translate_unit, filename, commands, writer_options, fuse)
+                   for filename, commands in files]
+        units = [future.result() for future in futures]
+    link(output_file, units, writer_options)
 
 
-def send_command(parser: Parser, coder: CodeWriter) -> None:
+def write_stack_report(files: typing.List[typing.Tuple[str, typing.List[Optimizer.Command]]],
+                       report_path: str) -> None:
     """
-    gets the parser and the codeWriter and direct the cur_command to the suitable handler command in the codeWriter
-    according to its type
+    writes the maximal stack depth of every function of the given parsed files, deepest
+    first. a function needs its frame, its local variables and its stack depth on the stack
     """
-    command_type = parser.command_type()
-    if command_type == "C_ARITHMETIC":
-        coder.write_arithmetic(parser.arg1())
+    depths = dict()
+    for filename, commands in files:
+        depths.update(Optimizer.max_stack_depths(commands))
+    with open(report_path, 'w') as report_file:
+        report_file.write(f"{'locals':>8} {'depth':>8}  function "
+                          f"(a call takes {Optimizer.FRAME_SIZE} + locals + depth words)\n")
+        for function_name, (local_count, depth) in sorted(depths.items(), key=lambda item: -item[1][1]):
+            report_file.write(f"{local_count:8} {depth:8}  {function_name}\n")
+
+
+def write_inline_report(inlined: typing.Dict[str, typing.Tuple[int, int]], report_path: str) -> None:
+    """
+    writes the functions inlined by Optimizer.inline_functions, the most inlined first
+    """
+    with open(report_path, 'w') as report_file:
+        report_file.write(f"{'size':>8} {'calls':>8}  function (size in VM commands, calls inlined)\n")
+        for function_name, (size, count) in sorted(inlined.items(), key=lambda item: -item[1][1]):
+            report_file.write(f"{size:8} {count:8}  {function_name}\n")
+
+
+def assign_counters(files: typing.List[typing.Tuple[str, typing.List[Optimizer.Command]]]) \
+        -> typing.Dict[str, int]:
+    """
+    gives every function of the given parsed files a call counter, in the RAM between
+    COUNTERS_START and COUNTERS_END, in the order of the functions
+    """
+    function_names = [command.symbol for filename, commands in files
+                      for command in commands if command.opcode == C_FUNCTION]
+    if len(function_names) > COUNTERS_END - COUNTERS_START:
+        raise ValueError(f"{len(function_names)} functions don't fit in the "
+                         f"{COUNTERS_END - COUNTERS_START} call counters")
+    return {function_name: COUNTERS_START + i for i, function_name in enumerate(function_names)}
+
+
+def write_counter_map(counters: typing.Dict[str, int], map_path: str) -> None:
+    """
+    writes a JSON object of the RAM address of every call counter -> its function name, so
+    the RAM at the end of any run can be read as the number of calls of every function
+    """
+    with open(map_path, 'w') as map_file:
+        json.dump({str(address): function_name for function_name, address in counters.items()},
+                  map_file, indent=1)
+
+
+def send_command(command: Optimizer.Command, coder: CodeWriter) -> None:
+    """
+    gets a parsed command and the codeWriter and direct the command to the suitable handler command in the
+    codeWriter according to its type
+    """
+    opcode = command.opcode
+    if opcode == C_ARITHMETIC:
+        coder.write_arithmetic(command.symbol)
+        return
+
+    if opcode == C_PUSH or opcode == C_POP:
+        coder.write_push_pop(COMMAND_TYPES[opcode], SEGMENT_NAMES[command.segment], command.arg)
         return
 
-    if command_type == "C_PUSH" or command_type == "C_POP":
-        coder.write_push_pop(command_type, parser.arg1(), parser.arg2())
+    if opcode == C_GOTO or opcode == C_IF or opcode == C_LABEL:
+        coder.write_branching(COMMAND_TYPES[opcode], command.symbol)
         return
 
-    if command_type == "C_GOTO" or command_type == "C_IF" or command_type == "C_LABEL":
-        coder.write_branching(command_type, parser.arg1())
+    if opcode == C_FUNCTION or opcode == C_CALL:
+        coder.write_functions(COMMAND_TYPES[opcode], command.symbol, command.arg)
         return
 
-    if command_type == "C_FUNCTION" or command_type == "C_CALL":
-        coder.write_functions(command_type, parser.arg1(), parser.arg2())
+    if opcode == C_RETURN:
+        coder.write_return(COMMAND_TYPES[opcode])
         return
 
-    if command_type == "C_RETURN":
-        coder.write_return(command_type)
+    if opcode == Optimizer.ADD_CONSTANT:
+        coder.write_add_constant(command.arg)
+        return
+
+    if opcode == Optimizer.TAIL_CALL:
+        coder.write_tail_call(command.symbol, command.arg, command.caller_args)
+        return
+
+    if opcode == Optimizer.MOVE:
+        coder.write_move((SEGMENT_NAMES[command.source_segment], command.source_index),
+                         (SEGMENT_NAMES[command.destination_segment], command.destination_index))
         return
 
 
 if "__main__" == __name__:
-    # Parses the input path and calls translate_file on each input file.
+    # Parses the input path, parses every input file and translates them all.
     # This opens both the input and the output files!
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(prog="VMtranslator")
+    arg_parser.add_argument("input_path", help="a .vm file or a directory of .vm files")
+    arg_parser.add_argument("--shared-calls", action="store_true",
+                            help="jump to one shared call routine and one shared return routine "
+                                 "instead of inlining them, for smaller programs")
+    arg_parser.add_argument("-O", dest="optimize", choices=[OPTIMIZE_SIZE, OPTIMIZE_SPEED], default=OPTIMIZE_SIZE,
+                            help="'size' jumps to shared comparison blocks, 'speed' writes the "
+                                 "comparisons inline")
+    arg_parser.add_argument("--fuse", action="store_true",
+                            help="fuse common sequences of VM commands (push constant / add, "
+                                 "push / pop...) into shorter code, and push the constants -1, 0 "
+                                 "and 1 without an A-instruction")
+    stack_mode = arg_parser.add_mutually_exclusive_group()
+    stack_mode.add_argument("--cache-top", action="store_true",
+                            help="keep the top of the stack in D between commands when possible")
+    stack_mode.add_argument("--batch-sp", action="store_true",
+                            help="address the stack as SP+k in straight-line code and update SP "
+                                 "once per block")
+    arg_parser.add_argument("--fold", action="store_true",
+                            help="evaluate constant expressions (push constant 3 / push constant 4 / "
+                                 "add...) and drop the commands that do nothing at translation time")
+    arg_parser.add_argument("--inline", type=int, nargs="?", const=Optimizer.DEFAULT_INLINE_SIZE, metavar="SIZE",
+                            help="inline the calls of leaf functions of up to SIZE commands (default "
+                                 f"{Optimizer.DEFAULT_INLINE_SIZE}) and write an .inline report")
+    arg_parser.add_argument("--tail-calls", action="store_true",
+                            help="make a call directly followed by a return reuse the frame of the "
+                                 "calling function, so tail recursion runs in constant stack space")
+    arg_parser.add_argument("--remove-unused-functions", action="store_true",
+                            help="translate only the functions that Sys.init can reach through calls")
+    arg_parser.add_argument("--stack-report", action="store_true",
+                            help="write a .stack file with the maximal stack depth of every function")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                            help="translate the files on N worker processes and link the results")
+    arg_parser.add_argument("--no-comments", dest="comments", action="store_false",
+                            help="write only code, without a comment for every VM command")
+    arg_parser.add_argument("--instrument", action="store_true",
+                            help=f"count the calls of every function in RAM from {COUNTERS_START} on, "
+                                 "and write a .counters.json map of the counter addresses")
+    arg_parser.add_argument("--emit", choices=[ASM_FORMAT, HACK_FORMAT, BINARY_FORMAT], default=ASM_FORMAT,
+                            help="write an .asm file, or the machine code directly: a .hack text "
+                                 "file or a .bin file of packed 16 bit words")
+    arg_parser.add_argument("--symbol-map", action="store_true",
+                            help="with --emit hack/bin, also write a .sym file with the ROM address "
+                                 "of every label and VM command and the RAM address of every variable")
+    args = arg_parser.parse_args()
+    argument_path = os.path.abspath(args.input_path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
         output_path = os.path.join(argument_path, os.path.basename(
             argument_path))
     else:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
-    output_path += ".asm"
-    with open(output_path, 'w') as output_file:
-        coder = CodeWriter(output_file)
-        coder.write_init()
-
-        for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
-            with open(input_path, 'r') as input_file:
-                translate_file(input_file, coder)
-        coder.fill_missing_functions()
+    if args.symbol_map and args.emit == ASM_FORMAT:
+        arg_parser.error("--symbol-map needs --emit hack or --emit bin")
+    parsed_files = []
+    for input_path in files_to_translate:
+        filename, extension = os.path.splitext(input_path)
+        if extension.lower() != ".vm":
+            continue
+        with open(input_path, 'r') as input_file:
+            parsed_files.append((os.path.basename(filename), parse_file(input_file)))
+    if args.fold:
+        parsed_files = [(filename, Optimizer.fold_constants(commands)) for filename, commands in parsed_files]
+    if args.inline is not None:
+        parsed_files, inlined = Optimizer.inline_functions(parsed_files, args.inline)
+        write_inline_report(inlined, output_path + ".inline")
+    if args.tail_calls:
+        parsed_files = Optimizer.optimize_tail_calls(parsed_files)
+    if args.remove_unused_functions:
+        parsed_files = Optimizer.remove_unreachable_functions(parsed_files, CodeWriter.INIT_FUNC)
+    if args.stack_report:
+        write_stack_report(parsed_files, output_path + ".stack")
+
+    writer_options = dict(shared_calls=args.shared_calls, optimize=args.optimize,
+                          cache_top=args.cache_top, batch_sp=args.batch_sp, comments=args.comments,
+                          small_constants=args.fuse)
+    if args.instrument:
+        writer_options["counters"] = assign_counters(parsed_files)
+        write_counter_map(writer_options["counters"], output_path + ".counters.json")
+    if args.emit == ASM_FORMAT:
+        output_file = open(output_path + ".asm", 'w')
+    else:
+        symbol_map_file = None
+        if args.symbol_map:
+            symbol_map_file = open(output_path + SYMBOL_MAP_EXTENSION, 'w')
+        if args.emit == BINARY_FORMAT:
+            machine_file = open(output_path + BINARY_EXTENSION, 'wb')
+        else:
+            machine_file = open(output_path + HACK_EXTENSION, 'w')
+        output_file = HackWriter(machine_file, binary=args.emit == BINARY_FORMAT,
+                                 symbol_map_file=symbol_map_file)
+    with output_file:
+        if args.jobs > 1 and len(parsed_files) > 1:
+            translate_in_parallel(output_file, parsed_files, args.jobs, writer_options, args.fuse)
+        else:
+            coder = CodeWriter(output_file, **writer_options)
+            coder.write_init()
+
+            for filename, commands in parsed_files:
+                translate_commands(filename, commands, coder, args.fuse)
+            coder.fill_missing_functions()
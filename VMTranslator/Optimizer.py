@@ -0,0 +1,459 @@
+"""This file is part of nand2tetris, as taught in The Hebrew University,
+and was written by Aviv Yaish according to the specifications given in
+https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
+and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import VMCommand, SEGMENT_IDS, NO_SEGMENT, C_ARITHMETIC as ARITHMETIC, C_PUSH as PUSH, \
+    C_POP as POP, C_LABEL as LABEL, C_GOTO as GOTO, C_IF as IF, C_FUNCTION as FUNCTION, C_RETURN as RETURN, \
+    C_CALL as CALL
+
+# the opcodes of the commands made by the fusion, on top of the Parser opcodes:
+#   ADD_CONSTANT - a VMCommand that adds its arg to the stack top in place
+#   MOVE         - a Move, that copies between memory segments
+#   TAIL_CALL    - a TailCall, a call followed by a return (see optimize_tail_calls)
+ADD_CONSTANT = 9
+MOVE = 10
+TAIL_CALL = 11
+
+
+class Move:
+    """
+    a fused push / pop: copies the source segment entry to the destination segment entry
+    """
+    __slots__ = ("source_segment", "source_index", "destination_segment", "destination_index")
+    opcode = MOVE
+
+    def __init__(self, source_segment: int, source_index: int, destination_segment: int,
+                 destination_index: int) -> None:
+        self.source_segment = source_segment
+        self.source_index = source_index
+        self.destination_segment = destination_segment
+        self.destination_index = destination_index
+
+
+class TailCall:
+    """
+    a fused call / return of a function that has at least as many arguments as the call
+    """
+    __slots__ = ("symbol", "arg", "caller_args")
+    opcode = TAIL_CALL
+
+    def __init__(self, symbol: str, arg: int, caller_args: int) -> None:
+        self.symbol = symbol
+        self.arg = arg
+        self.caller_args = caller_args
+
+
+# a command of the translator: a parsed VMCommand or a fused one
+Command = typing.Union[VMCommand, Move, TailCall]
+
+BINARY_COMMANDS = ("add", "sub", "and", "or", "eq", "gt", "lt")
+FRAME_SIZE = 5      # the return address, LCL, ARG, THIS and THAT, pushed by every call
+CONSTANT = SEGMENT_IDS["constant"]
+ARGUMENT = SEGMENT_IDS["argument"]
+LOCAL = SEGMENT_IDS["local"]
+TEMP = SEGMENT_IDS["temp"]
+POINTER = SEGMENT_IDS["pointer"]
+STATIC = SEGMENT_IDS["static"]
+TEMP_SIZE = 8
+MULTIPLY = "Math.multiply"
+# the constant folding of the arithmetic commands, on signed 16 bit words
+FOLDED_UNARY = {"neg": lambda x: -x, "not": lambda x: ~x, "shiftleft": lambda x: x << 1,
+                "shiftright": lambda x: x >> 1}
+FOLDED_BINARY = {"add": lambda x, y: x + y, "sub": lambda x, y: x - y, "and": lambda x, y: x & y,
+                 "or": lambda x, y: x | y, "eq": lambda x, y: -(x == y), "gt": lambda x, y: -(x > y),
+                 "lt": lambda x, y: -(x < y)}
+# (constant, arithmetic command): the command does nothing with the constant as its y
+NEUTRAL_CONSTANTS = {(0, "add"), (0, "sub"), (0, "or"), (-1, "and")}
+SELF_INVERSE = ("neg", "not")
+DEFAULT_INLINE_SIZE = 12    # the number of commands in the largest function inlined by default
+
+
+def fuse(commands: typing.Iterable[Command]) -> typing.List[Command]:
+    """
+    slides a window over the commands of a file and replaces the sequences that go
+    through the stack for nothing with a single command that CodeWriter writes directly:
+    - push constant c / add (or sub) -> adds c (or -c) to the stack top in place.
+    - push constant c / neg -> push constant -c, push constant c / not -> push constant !c
+      (push constant 0 / not pushes true directly).
+    - push x / pop y -> moves x to y without touching the stack.
+    the window is checked again after every replacement, so that replaced commands fuse
+    further (push constant 1 / neg / add -> adds -1). labels are commands too, so no
+    sequence that can be jumped into the middle of is ever fused.
+    """
+    fused = []
+    for command in commands:
+        fused.append(command)
+        while len(fused) >= 2:
+            replacement = _fuse_pair(fused[-2], fused[-1])
+            if replacement is None:
+                break
+            del fused[-2:]
+            fused.append(replacement)
+    return fused
+
+
+def fold_constants(commands: typing.Iterable[Command]) -> typing.List[Command]:
+    """
+    slides a window over the commands of a file and evaluates what can be evaluated at
+    translation time, with the 16 bit wraparound of the Hack ALU:
+    - push constant x / push constant y / binary command -> push constant (x op y), the
+      comparisons push true (-1) or false (0).
+    - push constant x / neg, not, shiftleft or shiftright -> push constant (op x).
+    - push constant x / push constant y / call Math.multiply 2 -> push constant x*y (the OS
+      multiplication wraps around the same way).
+    - the commands that do nothing are dropped: push constant 0 / add, sub or or,
+      push constant -1 / and, push constant 1 / call Math.multiply 2, neg / neg and not / not.
+    like fuse, the window is checked again after every replacement, so folding cascades
+    (push constant 3 / neg / push constant 4 / add -> push constant 1), and labels stop it.
+    """
+    folded = []
+    for command in commands:
+        folded.append(command)
+        while True:
+            folding = _fold_tail(folded)
+            if folding is None:
+                break
+            length, replacement = folding
+            del folded[-length:]
+            folded.extend(replacement)
+    return folded
+
+
+def split_functions(commands: typing.List[Command]) -> typing.List[typing.List[Command]]:
+    """
+    splits the commands of a file into its functions, each starting at its function
+    command. the commands before the first function, if any, come first
+    """
+    functions = [[]]
+    for command in commands:
+        if command.opcode == FUNCTION:
+            functions.append([])
+        functions[-1].append(command)
+    if not functions[0]:
+        functions.pop(0)
+    return functions
+
+
+def remove_unreachable_functions(files: typing.List[typing.Tuple[str, typing.List[Command]]],
+                                 root: str) -> typing.List[typing.Tuple[str, typing.List[Command]]]:
+    """
+    the link step: builds the call graph of all the files and keeps only the functions that
+    the root function reaches through calls. the VM has no function pointers, so a function
+    that is never named by a reachable call can't run. if the root function is not defined,
+    the files are returned as they are
+
+    Args:
+        files (list): (file name, parsed commands) of every file of the program.
+        root (str): the function the program starts at.
+
+    Returns:
+        list: (file name, commands) of every file, without the unreachable functions.
+    """
+    calls = dict()
+    for filename, commands in files:
+        for function in split_functions(commands):
+            if function[0].opcode == FUNCTION:
+                calls[function[0].symbol] = {command.symbol for command in function
+                                             if command.opcode == CALL or command.opcode == TAIL_CALL}
+    if root not in calls:
+        return files
+
+    reachable = set()
+    pending = [root]
+    while pending:
+        function_name = pending.pop()
+        if function_name in reachable:
+            continue
+        reachable.add(function_name)
+        pending.extend(calls.get(function_name, ()))
+
+    return [(filename, [command for function in split_functions(commands)
+                        if function[0].opcode != FUNCTION or function[0].symbol in reachable
+                        for command in function])
+            for filename, commands in files]
+
+
+def max_stack_depths(commands: typing.List[Command]) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """
+    a static analysis of the stack depth along every path of every function of a file,
+    with the stack depth at every label taken from the first jump (or fallthrough) reaching
+    it. the depth counts the entries the function pushes above its local variables,
+    including the frames of the calls it makes (but not what the called functions push).
+
+    Returns:
+        dict: function name -> (number of local variables, maximal stack depth).
+    """
+    depths = dict()
+    for function in split_functions(commands):
+        if function[0].opcode != FUNCTION:
+            continue
+        depth_at, max_depth = _stack_depths(function)
+        depths[function[0].symbol] = (function[0].arg, max_depth)
+    return depths
+
+
+def inline_functions(files: typing.List[typing.Tuple[str, typing.List[Command]]],
+                     max_size: int = DEFAULT_INLINE_SIZE) \
+        -> typing.Tuple[typing.List[typing.Tuple[str, typing.List[Command]]], typing.Dict[str, typing.Tuple[int, int]]]:
+    """
+    replaces the calls of small leaf functions (no calls of their own, so never recursive)
+    with their bodies, saving the frame setup and teardown of the call and the return.
+    the arguments, local variables and temp entries of the inlined function are remapped
+    to temp entries the calling function doesn't use, and that no function of the program
+    might hold across a call (temp is global, so a function further up the call stack
+    may keep a value in it while it calls the calling function): the entries read by the
+    functions that make calls are never used. its labels are renamed per call site,
+    its returns jump to the end of the inlined body and the pointers it sets are restored
+    at the end. statics keep pointing at the file of the inlined function. a call is left as
+    it is when there are not enough free temp entries. the inlined functions themselves
+    are kept, see remove_unreachable_functions
+
+    Args:
+        files (list): (file name, parsed commands) of every file of the program.
+        max_size (int): the number of commands (without the function command) in the
+        largest function to inline.
+
+    Returns:
+        list: (file name, commands) of every file, with the calls inlined.
+        dict: inlined function name -> (size, number of inlined calls).
+    """
+    candidates = dict()     # function name -> (file name, function commands)
+    for filename, commands in files:
+        for function in split_functions(commands):
+            if function[0].opcode == FUNCTION and _is_inlinable(function, max_size):
+                candidates[function[0].symbol] = (filename, function)
+
+    held_temps = set()     # the temp entries a function might hold across one of its calls
+    for filename, commands in files:
+        for function in split_functions(commands):
+            if any(command.opcode == CALL or command.opcode == TAIL_CALL for command in function):
+                held_temps |= _segment_indices(function, TEMP, (PUSH,))
+
+    inlined = dict()
+    sites = 0
+    inlined_files = []
+    for filename, commands in files:
+        inlined_commands = []
+        for function in split_functions(commands):
+            used_temps = _segment_indices(function, TEMP) | held_temps
+            free_slots = [index for index in range(TEMP_SIZE) if index not in used_temps]
+            for command in function:
+                if command.opcode == CALL and command.symbol in candidates:
+                    callee_file, callee = candidates[command.symbol]
+                    body = _inline_call(command, callee, callee_file, filename, free_slots,
+                                        f"{command.symbol}$inline{sites}$")
+                    if body is not None:
+                        sites += 1
+                        inlined_commands.extend(body)
+                        size, count = inlined.get(command.symbol, (len(callee) - 1, 0))
+                        inlined[command.symbol] = (size, count + 1)
+                        continue
+                inlined_commands.append(command)
+        inlined_files.append((filename, inlined_commands))
+    return inlined_files, inlined
+
+
+def optimize_tail_calls(files: typing.List[typing.Tuple[str, typing.List[Command]]]) \
+        -> typing.List[typing.Tuple[str, typing.List[Command]]]:
+    """
+    fuses every call that is directly followed by a return into a TailCall, that reuses
+    the frame of the calling function, so chains of tail calls (like tail recursion) run
+    in constant stack space. the function declarations don't tell how many arguments a
+    function has, so it is taken from the calls of the function: a tail call is fused only
+    if all the calls of the calling function pass the same number of arguments, and at least
+    as many as the tail call passes (so the arguments of the tail call fit in place).
+
+    Returns:
+        list: (file name, commands) of every file, with the tail calls fused.
+    """
+    arg_counts = dict()     # function name -> the numbers of arguments its calls pass
+    for filename, commands in files:
+        for command in commands:
+            if command.opcode == CALL:
+                arg_counts.setdefault(command.symbol, set()).add(command.arg)
+
+    fused_files = []
+    for filename, commands in files:
+        fused = []
+        function_args = None
+        for command in commands:
+            if command.opcode == FUNCTION:
+                counts = arg_counts.get(command.symbol, ())
+                function_args = next(iter(counts)) if len(counts) == 1 else None
+            elif command.opcode == RETURN and fused and fused[-1].opcode == CALL and \
+                    function_args is not None and fused[-1].arg <= function_args:
+                call = fused.pop()
+                fused.append(TailCall(call.symbol, call.arg, function_args))
+                continue
+            fused.append(command)
+        fused_files.append((filename, fused))
+    return fused_files
+
+
+def _stack_depths(function: typing.List[Command]) -> typing.Tuple[typing.Dict[int, int], int]:
+    """
+    the stack depth before every reachable command of the function (by its index in the
+    function), and the maximal stack depth. see max_stack_depths
+    """
+    label_index = {command.symbol: i for i, command in enumerate(function) if command.opcode == LABEL}
+    depth_at = dict()
+    max_depth = 0
+    pending = [(1, 0)]
+    while pending:
+        i, depth = pending.pop()
+        while i < len(function) and i not in depth_at:
+            depth_at[i] = depth
+            command = function[i]
+            opcode = command.opcode
+            if opcode == PUSH:
+                depth += 1
+            elif opcode == POP or opcode == IF or \
+                    (opcode == ARITHMETIC and command.symbol in BINARY_COMMANDS):
+                depth -= 1
+            elif opcode == CALL:
+                max_depth = max(max_depth, depth + FRAME_SIZE)
+                depth += 1 - command.arg
+            max_depth = max(max_depth, depth)
+
+            if (opcode == GOTO or opcode == IF) and command.symbol in label_index:
+                pending.append((label_index[command.symbol], depth))
+            if opcode == GOTO or opcode == RETURN or opcode == TAIL_CALL:
+                break
+            i += 1
+    return depth_at, max_depth
+
+
+def _segment_indices(commands: typing.List[Command], segment: int, opcodes=(PUSH, POP)) -> typing.Set[int]:
+    """
+    the indices of the given segment used by the push/pop commands (of the given opcodes)
+    """
+    return {command.arg for command in commands if command.opcode in opcodes and command.segment == segment}
+
+
+def _is_inlinable(function: typing.List[Command], max_size: int) -> bool:
+    """
+    is the function small, without calls, and returning with exactly the return value
+    on its stack on every path
+    """
+    if len(function) - 1 > max_size or function[-1].opcode not in (RETURN, GOTO):
+        return False
+    if any(command.opcode == CALL or command.opcode == TAIL_CALL for command in function):
+        return False
+    depth_at, max_depth = _stack_depths(function)
+    returns = [i for i in depth_at if function[i].opcode == RETURN]
+    return bool(returns) and all(depth_at[i] == 1 for i in returns)
+
+
+def _inline_call(call: VMCommand, callee: typing.List[Command], callee_file: str, caller_file: str,
+                 free_slots: typing.List[int], label_prefix: str) -> typing.Optional[typing.List[Command]]:
+    """
+    the commands that replace the call with the body of the callee, None if the callee
+    needs more temp entries than the free ones (or reads arguments the call doesn't pass)
+    """
+    body = callee[1:]
+    if any(index >= call.arg for index in _segment_indices(body, ARGUMENT)):
+        return None
+    locals_used = sorted(_segment_indices(body, LOCAL))
+    saved_pointers = sorted(_segment_indices(body, POINTER, (POP,)))
+    remapped = [(ARGUMENT, index) for index in range(call.arg)] + [(LOCAL, index) for index in locals_used] + \
+        [(TEMP, index) for index in sorted(_segment_indices(body, TEMP))] + \
+        [(POINTER, index) for index in saved_pointers]
+    if len(remapped) > len(free_slots):
+        return None
+    slots = dict(zip(remapped, free_slots))
+
+    inlined = [VMCommand(POP, TEMP, "", slots[(ARGUMENT, index)]) for index in reversed(range(call.arg))]
+    for index in saved_pointers:
+        inlined.append(VMCommand(PUSH, POINTER, "", index))
+        inlined.append(VMCommand(POP, TEMP, "", slots[(POINTER, index)]))
+    for index in locals_used:
+        inlined.append(VMCommand(PUSH, CONSTANT, "", 0))
+        inlined.append(VMCommand(POP, TEMP, "", slots[(LOCAL, index)]))
+
+    end_label = label_prefix + "END"
+    jumps_to_end = False
+    for i, command in enumerate(body):
+        opcode = command.opcode
+        if opcode == PUSH or opcode == POP:
+            if command.segment in (ARGUMENT, LOCAL, TEMP):
+                command = VMCommand(opcode, TEMP, "", slots[(command.segment, command.arg)])
+            elif command.segment == STATIC and callee_file != caller_file:
+                command = VMCommand(opcode, STATIC, callee_file, command.arg)
+        elif opcode == LABEL or opcode == GOTO or opcode == IF:
+            command = VMCommand(opcode, NO_SEGMENT, label_prefix + command.symbol)
+        elif opcode == RETURN:
+            if i == len(body) - 1:
+                continue
+            jumps_to_end = True
+            command = VMCommand(GOTO, NO_SEGMENT, end_label)
+        inlined.append(command)
+    if jumps_to_end:
+        inlined.append(VMCommand(LABEL, NO_SEGMENT, end_label))
+
+    for index in saved_pointers:
+        inlined.append(VMCommand(PUSH, TEMP, "", slots[(POINTER, index)]))
+        inlined.append(VMCommand(POP, POINTER, "", index))
+    return inlined
+
+
+def _fuse_pair(first: Command, second: Command) -> typing.Optional[Command]:
+    """
+    returns the command that replaces the two given ones, None if they don't fuse
+    """
+    if first.opcode != PUSH or first.symbol:
+        return None     # statics of another file (see inline_functions) are not fused
+
+    if first.segment == CONSTANT and second.opcode == ARITHMETIC:
+        if second.symbol == "add":
+            return VMCommand(ADD_CONSTANT, NO_SEGMENT, "", first.arg)
+        if second.symbol == "sub":
+            return VMCommand(ADD_CONSTANT, NO_SEGMENT, "", _to_word(-first.arg))
+        if second.symbol == "neg":
+            return VMCommand(PUSH, CONSTANT, "", _to_word(-first.arg))
+        if second.symbol == "not":
+            return VMCommand(PUSH, CONSTANT, "", _to_word(-first.arg - 1))
+
+    if second.opcode == POP and not second.symbol:
+        return Move(first.segment, first.arg, second.segment, second.arg)
+    return None
+
+
+def _fold_tail(commands: typing.List[Command]) -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """
+    returns the number of commands at the end of the given ones that fold, and the commands
+    that replace them. None if they don't fold
+    """
+    last = commands[-1]
+    constants = []      # the values of the constant pushes right before the last command
+    for command in reversed(commands[-3:-1]):
+        if command.opcode != PUSH or command.segment != CONSTANT:
+            break
+        constants.insert(0, command.arg)
+
+    if last.opcode == ARITHMETIC:
+        if last.symbol in FOLDED_UNARY and len(constants) >= 1:
+            return 2, [VMCommand(PUSH, CONSTANT, "", _to_word(FOLDED_UNARY[last.symbol](constants[-1])))]
+        if last.symbol in FOLDED_BINARY and len(constants) == 2:
+            x, y = constants
+            return 3, [VMCommand(PUSH, CONSTANT, "", _to_word(FOLDED_BINARY[last.symbol](x, y)))]
+        if constants and (constants[-1], last.symbol) in NEUTRAL_CONSTANTS:
+            return 2, []
+        if last.symbol in SELF_INVERSE and len(commands) >= 2 and commands[-2].opcode == ARITHMETIC and \
+                commands[-2].symbol == last.symbol:
+            return 2, []
+
+    if last.opcode == CALL and last.symbol == MULTIPLY and last.arg == 2:
+        if len(constants) == 2:
+            x, y = constants
+            return 3, [VMCommand(PUSH, CONSTANT, "", _to_word(x * y))]
+        if constants and constants[-1] == 1:
+            return 2, []
+    return None
+
+
+def _to_word(value: int) -> int:
+    """wraps the value to a signed 16 bit word, like the Hack ALU"""
+    return (value + 0x8000) % 0x10000 - 0x8000
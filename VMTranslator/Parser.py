@@ -4,10 +4,54 @@ https://www.nand2tetris.org (Shimon Schocken and Noam Nisan, 2017)
 and as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0 
 Unported License (https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import sys
 import typing
 
 COMMENT ="//"
 
+# the opcodes of the parsed commands, and the command types they stand for
+C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL = range(9)
+COMMAND_TYPES = ("C_ARITHMETIC", "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION", "C_RETURN",
+                 "C_CALL")
+OPCODES = {"push": C_PUSH, "pop": C_POP, "label": C_LABEL, "goto": C_GOTO, "if-goto": C_IF,
+           "function": C_FUNCTION, "return": C_RETURN, "call": C_CALL}
+
+# the segment ids of push/pop commands are indices in SEGMENT_NAMES
+SEGMENT_NAMES = ("local", "argument", "this", "that", "constant", "static", "temp", "pointer")
+SEGMENT_IDS = {name: segment_id for segment_id, name in enumerate(SEGMENT_NAMES)}
+NO_SEGMENT = -1
+
+
+class VMCommand:
+    """
+    A parsed VM command, the representation the translator and the optimizer work on.
+    Every command is parsed once, into:
+        opcode (int): one of C_ARITHMETIC, C_PUSH... (see COMMAND_TYPES).
+        segment (int): the segment id of push/pop commands (see SEGMENT_NAMES), NO_SEGMENT otherwise.
+        symbol (str): the interned arithmetic command, label or function name. for static
+        push/pop, the file of the static if it isn't the file of the command (see
+        Optimizer.inline_functions). "" otherwise.
+        arg (int): the index of push/pop, the number of arguments of call or of local
+        variables of function, 0 otherwise.
+    """
+    __slots__ = ("opcode", "segment", "symbol", "arg")
+
+    def __init__(self, opcode: int, segment: int = NO_SEGMENT, symbol: str = "", arg: int = 0) -> None:
+        self.opcode = opcode
+        self.segment = segment
+        self.symbol = symbol
+        self.arg = arg
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VMCommand) and (self.opcode, self.segment, self.symbol, self.arg) == \
+            (other.opcode, other.segment, other.symbol, other.arg)
+
+    def __hash__(self) -> int:
+        return hash((self.opcode, self.segment, self.symbol, self.arg))
+
+    def __repr__(self) -> str:
+        return f"VMCommand({COMMAND_TYPES[self.opcode]}, {self.segment}, {self.symbol!r}, {self.arg})"
+
 
 class Parser:
     """
@@ -24,7 +68,7 @@ class Parser:
             input_file (typing.TextIO): input file.
         """
         self.__lines = input_file.read().splitlines()
-        self.__cur_command = None
+        self.__cur_command = None   # the current VMCommand
         self.__next_valid_command = None #command index (int)
 
 
@@ -57,7 +101,7 @@ class Parser:
         command. Should be called only if has_more_commands() is true. Initially
         there is no current command.
         """
-        self.__cur_command = clean_command(self.__lines[self.__next_valid_command])
+        self.__cur_command = parse_command(clean_command(self.__lines[self.__next_valid_command]))
 
     def command_type(self) -> str:
         """
@@ -68,24 +112,7 @@ class Parser:
             "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION",
             "C_RETURN", "C_CALL".
         """
-        if self.__cur_command.startswith("push"):
-            return "C_PUSH"
-        elif self.__cur_command.startswith("pop"):
-            return "C_POP"
-        elif self.__cur_command.startswith("label"):
-            return "C_LABEL"
-        elif self.__cur_command.startswith("goto"):
-            return "C_GOTO"
-        elif self.__cur_command.startswith("if-goto"):
-            return "C_IF"
-        elif self.__cur_command.startswith("function"):
-            return "C_FUNCTION"
-        elif self.__cur_command.startswith("return"):
-            return "C_RETURN"
-        elif self.__cur_command.startswith("call"):
-            return "C_CALL"
-        else:
-            return "C_ARITHMETIC"
+        return COMMAND_TYPES[self.__cur_command.opcode]
 
 
     def arg1(self) -> str:
@@ -95,13 +122,11 @@ class Parser:
             "C_ARITHMETIC", the command itself (add, sub, etc.) is returned. 
             Should not be called if the current command is "C_RETURN".
         """
-        command_type = self.command_type()
-        if command_type == "C_RETURN":
-            return "" # not really needed
-        if command_type == "C_ARITHMETIC": # returns the command itself
-            return self.__cur_command
-        else:
-            return self.__cur_command.split(" ")[1]
+        if self.__cur_command.segment != NO_SEGMENT:
+            return SEGMENT_NAMES[self.__cur_command.segment]
+        return self.__cur_command.symbol
+            # "C_ARITHMETIC": returns the command itself
+            # "C_RETURN": returns "", not really needed
             # "C_PUSH" or "C_POP":  returns the segment
             # "C_LABEL": returns the label
             # "C_GOTO": returns the label to go to
@@ -117,12 +142,31 @@ class Parser:
             called only if the current command is "C_PUSH", "C_POP", 
             "C_FUNCTION" or "C_CALL".
         """
-        return int(self.__cur_command.split(" ")[2])
+        return self.__cur_command.arg
         # C_PUSH, C_POP return index in a segment
         # C_CALL returns number of arguments
         # C_FUNCTION returns number of local variables
 
 
+    def command(self) -> VMCommand:
+        """
+        Returns:
+            VMCommand: the current command.
+        """
+        return self.__cur_command
+
+
+    def commands(self) -> typing.Iterator[VMCommand]:
+        """
+        a stream of all the remaining commands of the file (lines holding nothing but
+        white space and comments are skipped)
+        """
+        while self.has_more_commands():
+            self.advance()
+            if self.__cur_command.symbol or self.__cur_command.opcode != C_ARITHMETIC:
+                yield self.__cur_command
+
+
 def is_valid_command(command: str) -> bool:
     """
     checks if the given command is valid: not empty, not a whitespace line and not a comment
@@ -131,6 +175,26 @@ def is_valid_command(command: str) -> bool:
         return False
     return True
 
+def parse_command(command: str) -> VMCommand:
+    """
+    parses a cleaned command into a VMCommand. an empty command is an arithmetic command
+    with no symbol, which writes nothing
+    """
+    words = command.split()
+    if not words:
+        return VMCommand(C_ARITHMETIC)
+    opcode = OPCODES.get(words[0], C_ARITHMETIC)
+    if opcode == C_PUSH or opcode == C_POP:
+        return VMCommand(opcode, SEGMENT_IDS[words[1]], "", int(words[2]))
+    if opcode == C_FUNCTION or opcode == C_CALL:
+        return VMCommand(opcode, NO_SEGMENT, sys.intern(words[1]), int(words[2]))
+    if opcode == C_ARITHMETIC:
+        return VMCommand(opcode, NO_SEGMENT, sys.intern(words[0]))
+    if opcode == C_RETURN:
+        return VMCommand(opcode)
+    return VMCommand(opcode, NO_SEGMENT, sys.intern(words[1]))
+
+
 def clean_command(command:str) -> str:
     """
     Filters a given command from spaces, comments after the command